@@ -7,16 +7,27 @@ retrieval. Returns answer + sources + links (web and/or documents).
 """
 
 import asyncio
+import functools
+import hashlib
 import logging
+import time
+from collections import OrderedDict
 from typing import Optional
 
-from google import genai
 from google.genai import types
 
-from app.config import GEMINI_API_KEY, MODEL, STORE_PREFIX
+from app.config import GEMINI_API_KEY, GEMINI_CONCURRENCY, MODEL, STORE_PREFIX, get_genai_client
+from app.services.resilience import gemini_breaker, is_retryable, with_retry
 
 logger = logging.getLogger(__name__)
 
+# Gate outgoing Gemini calls: waiting in-process is cheap, exhausting the
+# shared connection pool under burst load is not
+_gemini_sem = asyncio.Semaphore(GEMINI_CONCURRENCY)
+
+# How long the cached store list stays valid before a re-list (seconds)
+STORE_CACHE_TTL = 300.0
+
 # Base system instruction for ULSS 9 assistant (language-agnostic)
 SYSTEM_INSTRUCTION_BASE = """Sei l'assistente AI ufficiale del sito dell'Azienda ULSS 9 Scaligera (aulss9.veneto.it).
 
@@ -36,6 +47,43 @@ Regole:
 
 Contatti utili: URP Comunicazione, tel. 0458075511, sede legale Via Valverde 42 – 37122 Verona."""
 
+# Follow-up suggestion prompt prefixes (built once, not per call)
+FOLLOWUP_PROMPT_EN = """Based on this Q&A about ULSS 9 Scaligera healthcare services, suggest exactly 3 short follow-up questions the user might ask next.
+Return ONLY the 3 questions, one per line. No numbering, no bullets. Keep each question under 15 words.
+Language: English only.
+
+User question:
+"""
+
+FOLLOWUP_PROMPT_IT = """In base a questa domanda e risposta sull'assistente ULSS 9 Scaligera, suggerisci esattamente 3 brevi domande di seguito che l'utente potrebbe fare.
+Rispondi SOLO con le 3 domande, una per riga. Niente numeri, niente elenchi. Ogni domanda max 15 parole.
+Lingua: solo italiano.
+
+Domanda dell'utente:
+"""
+
+# Max memoized follow-up results (repeat Q&A pairs skip the Gemini call)
+FOLLOWUP_CACHE_MAX = 256
+
+# Cached Gemini chat sessions: idle eviction and a hard cap on entries
+SESSION_IDLE_TTL = 1800.0  # 30 min
+SESSION_CACHE_MAX = 1000
+
+# Snippet truncation marker, bound once for the grounding-chunk loop
+_ELLIPSIS = "..."
+
+
+@functools.lru_cache(maxsize=64)
+def _tool_for(store_names: tuple[str, ...]) -> types.Tool:
+    """
+    Memoized File Search tool for a given set of store names.
+    Tool/FileSearch construction goes through pydantic validation; identical
+    store sets recur on every chat, so build the object once per set.
+    """
+    return types.Tool(
+        file_search=types.FileSearch(file_search_store_names=list(store_names))
+    )
+
 
 class UniVRAgent:
     """
@@ -46,6 +94,21 @@ class UniVRAgent:
     def __init__(self):
         """Initialize the agent with Gemini client."""
         self.client = None
+        # Cache of display_name -> store, so _get_store does one list RPC
+        # per TTL window instead of one per lookup (N per multi-store chat).
+        self._store_cache: dict[str, types.FileSearchStore] = {}
+        self._store_cache_loaded_at: float | None = None
+        # Serializes cache refreshes so concurrent lookups share one list RPC
+        self._store_cache_lock = asyncio.Lock()
+        # Only two system instructions exist (it/en); build them once
+        self._system_instructions = {
+            lang: self._build_system_instruction(lang) for lang in ("it", "en")
+        }
+        # LRU of follow-up suggestions keyed by (lang, Q&A digest)
+        self._followup_cache: OrderedDict[tuple[str, bytes], list[str]] = OrderedDict()
+        # Chat sessions keyed by (conversation_id, lang, stores): consecutive
+        # turns reuse the session instead of re-sending setup every message
+        self._sessions: dict[tuple, tuple[object, float]] = {}
         self._initialize()
 
     def _initialize(self):
@@ -54,26 +117,83 @@ class UniVRAgent:
             logger.warning("GEMINI_API_KEY not set. Agent will run in demo mode.")
             return
         try:
-            self.client = genai.Client(api_key=GEMINI_API_KEY)
+            self.client = get_genai_client()
             logger.info("Gemini client initialized successfully")
         except Exception as e:
             logger.error(f"Failed to initialize Gemini client: {e}", exc_info=True)
             self.client = None
 
-    def _get_store(self, domain: str) -> types.FileSearchStore | None:
-        """Retrieve a File Search Store by domain (store id)."""
+    def _store_cache_valid(self) -> bool:
+        """True if the store cache has been loaded and is within its TTL."""
+        return (
+            self._store_cache_loaded_at is not None
+            and time.monotonic() - self._store_cache_loaded_at < STORE_CACHE_TTL
+        )
+
+    def _refresh_store_cache(self) -> None:
+        """Reload the display_name -> store cache with a single list RPC."""
+        cache: dict[str, types.FileSearchStore] = {}
+        for store in self.client.file_search_stores.list():
+            if store.display_name:
+                cache[store.display_name] = store
+        self._store_cache = cache
+        self._store_cache_loaded_at = time.monotonic()
+
+    async def prime_store_cache(self) -> None:
+        """Warm the store cache (used at startup so the first chat is fast)."""
+        if self.client:
+            await self._refresh_store_cache_async()
+
+    def cached_store_domains(self) -> list[str] | None:
+        """Domains in the store cache, or None if the cache is cold/expired."""
+        if not self._store_cache_valid():
+            return None
+        prefix = f"{STORE_PREFIX}-"
+        return [
+            name[len(prefix):]
+            for name in self._store_cache
+            if name.startswith(prefix)
+        ]
+
+    def invalidate_store_cache(self, domain: Optional[str] = None) -> None:
+        """
+        Drop cached store entries after external mutations (admin create/delete).
+        If domain is given, evict only that store; otherwise clear everything.
+        """
+        if domain is None:
+            self._store_cache = {}
+            self._store_cache_loaded_at = None
+        else:
+            self._store_cache.pop(f"{STORE_PREFIX}-{domain}", None)
+
+    async def _refresh_store_cache_async(self) -> None:
+        """Refresh the cache off the event loop; concurrent callers share one RPC."""
+        loaded_at = self._store_cache_loaded_at
+        async with self._store_cache_lock:
+            # Another coroutine may have refreshed while we waited on the lock
+            if self._store_cache_loaded_at != loaded_at:
+                return
+            await asyncio.to_thread(self._refresh_store_cache)
+
+    async def _get_store_async(self, domain: str) -> types.FileSearchStore | None:
+        """Retrieve a File Search Store by domain (store id), using the cache."""
         if not self.client:
             return None
         display_name = f"{STORE_PREFIX}-{domain}"
         try:
-            for store in self.client.file_search_stores.list():
-                if store.display_name == display_name:
-                    return store
+            if not self._store_cache_valid():
+                await self._refresh_store_cache_async()
+            store = self._store_cache.get(display_name)
+            if store is None:
+                # Miss may mean the store was just created: re-list once
+                await self._refresh_store_cache_async()
+                store = self._store_cache.get(display_name)
+            return store
         except Exception as e:
             logger.error(f"Error listing stores: {e}")
         return None
 
-    def _build_tools(
+    async def _build_tools(
         self,
         domain: Optional[str] = None,
         store_ids: Optional[list[str]] = None,
@@ -82,46 +202,35 @@ class UniVRAgent:
         Build the tools list for the agent.
         Returns (tools, stores_used): tools list and list of store ids actually used.
         """
-        tools = []
-        stores_used: list[str] = []
+        # Normalize: the single-domain (legacy) case is a one-element list
+        ids = store_ids or ([domain] if domain else [])
+        if not ids:
+            logger.debug("No domain or store_ids specified. Using generic agent (no RAG).")
+            return [], []
 
-        if store_ids:
-            # Multi-store: pass all selected store names
-            store_names: list[str] = []
-            for sid in store_ids:
-                store = self._get_store(sid)
-                if store and store.name:
-                    store_names.append(store.name)
-                    stores_used.append(sid)
-                else:
-                    logger.warning(f"Store for id '{sid}' not found, skipping")
-            if store_names:
-                tools.append(
-                    types.Tool(
-                        file_search=types.FileSearch(
-                            file_search_store_names=store_names
-                        )
-                    )
-                )
-                logger.debug(f"File Search tool configured with stores: {stores_used}")
-        elif domain:
-            # Single domain (legacy)
-            store = self._get_store(domain)
+        # Resolve all stores concurrently, one RTT instead of N
+        results = await asyncio.gather(
+            *(self._get_store_async(sid) for sid in ids),
+            return_exceptions=True,
+        )
+        store_names: list[str] = []
+        stores_used: list[str] = []
+        for sid, store in zip(ids, results):
+            if isinstance(store, BaseException):
+                logger.warning(f"Store lookup for id '{sid}' failed: {store}")
+                continue
             if store and store.name:
-                tools.append(
-                    types.Tool(
-                        file_search=types.FileSearch(
-                            file_search_store_names=[store.name]
-                        )
-                    )
-                )
-                stores_used = [domain]
-                logger.debug(f"File Search tool configured with domain '{domain}'")
+                store_names.append(store.name)
+                stores_used.append(sid)
             else:
-                logger.warning(f"Store for domain '{domain}' not found. Using generic agent.")
-        else:
-            logger.debug("No domain or store_ids specified. Using generic agent (no RAG).")
+                logger.warning(f"Store for id '{sid}' not found, skipping")
+
+        if not store_names:
+            logger.warning(f"No stores found for {ids}. Using generic agent.")
+            return [], []
 
+        tools = [_tool_for(tuple(sorted(store_names)))]
+        logger.debug(f"File Search tool configured with stores: {stores_used}")
         return tools, stores_used
 
     def _extract_sources_and_links(self, response) -> tuple[list[dict], list[dict]]:
@@ -140,9 +249,16 @@ class UniVRAgent:
         gm = response.candidates[0].grounding_metadata
         chunks = getattr(gm, "grounding_chunks", None) or []
 
+        # Pre-bind hot methods; grounding can return dozens of chunks per response
+        sources_append = sources.append
+        links_append = links.append
+        seen_add = links_seen.add
+        links_full = False
+
         for chunk in chunks:
             content = getattr(chunk, "content", "") or ""
-            snippet = (content[:200] + "...") if len(content) > 200 else content
+            # Branchless: the slice is "..." when truncated, "" otherwise
+            snippet = content[:200] + _ELLIPSIS[:3 * (len(content) > 200)]
 
             # Try to get metadata from chunk (Gemini may expose custom_metadata on retrieved chunks)
             meta = getattr(chunk, "custom_metadata", None) or {}
@@ -158,28 +274,54 @@ class UniVRAgent:
             doc_id = meta.get("document_id")
             source_type = meta.get("source_type", "website" if url else "attachment")
 
-            sources.append({
+            sources_append({
                 "title": title,
                 "url": url,
                 "snippet": snippet,
                 "source_type": source_type,
             })
 
+            if links_full:
+                continue
             key = (url or doc_id or "", title)
-            if key in links_seen or len(links) >= 5:
+            if key in links_seen:
                 continue
-            links_seen.add(key)
+            seen_add(key)
 
             link_entry: dict = {"title": title, "source_type": source_type}
             if url:
                 link_entry["url"] = url
             if doc_id:
                 link_entry["document_id"] = doc_id
-            links.append(link_entry)
+            links_append(link_entry)
+            links_full = len(links) >= 5
 
         return sources, links
 
-    def _system_instruction(self, language: Optional[str] = None) -> str:
+    def _get_cached_session(self, key: tuple):
+        """Return a cached, non-expired chat session for key, or None."""
+        entry = self._sessions.get(key)
+        if entry is None:
+            return None
+        session, last_used = entry
+        if time.monotonic() - last_used > SESSION_IDLE_TTL:
+            self._sessions.pop(key, None)
+            return None
+        self._sessions[key] = (session, time.monotonic())
+        return session
+
+    def _store_session(self, key: tuple, session) -> None:
+        """Cache a chat session, evicting expired then oldest entries at the cap."""
+        if len(self._sessions) >= SESSION_CACHE_MAX:
+            now = time.monotonic()
+            for k in [k for k, (_, ts) in self._sessions.items() if now - ts > SESSION_IDLE_TTL]:
+                self._sessions.pop(k, None)
+            while len(self._sessions) >= SESSION_CACHE_MAX:
+                oldest = min(self._sessions, key=lambda k: self._sessions[k][1])
+                self._sessions.pop(oldest, None)
+        self._sessions[key] = (session, time.monotonic())
+
+    def _build_system_instruction(self, language: Optional[str] = None) -> str:
         """Build system instruction with language rule. language is 'it' or 'en'."""
         lang_rule = (
             "Always respond in English. Keep the same tone and rules."
@@ -188,12 +330,17 @@ class UniVRAgent:
         )
         return f"{SYSTEM_INSTRUCTION_BASE}\n\n{lang_rule}"
 
+    def _system_instruction(self, language: Optional[str] = None) -> str:
+        """Return the memoized system instruction for 'it' or 'en'."""
+        return self._system_instructions["en" if language == "en" else "it"]
+
     async def chat(
         self,
         message: str,
         domain: Optional[str] = None,
         store_ids: Optional[list[str]] = None,
         language: Optional[str] = None,
+        conversation_id: Optional[str] = None,
     ) -> dict:
         """
         Send a message and get a response from the agent.
@@ -203,6 +350,8 @@ class UniVRAgent:
             domain: Optional single domain (store id) for RAG; if set, store_ids is ignored
             store_ids: Optional list of store ids for multi-store RAG (used when domain is None)
             language: Optional "it" or "en"; response language (default Italian)
+            conversation_id: Optional id; consecutive turns with the same id,
+                language and stores reuse one Gemini chat session
 
         Returns:
             dict with 'response', 'sources', 'links', 'stores_used'
@@ -215,30 +364,51 @@ class UniVRAgent:
             logger.warning("Running in demo mode - client not available")
             return self._demo_response(message)
 
+        if gemini_breaker.is_open():
+            logger.warning("Gemini circuit open; serving demo response without a round-trip")
+            return self._demo_response(message)
+
         lang = (language or "it").strip().lower()
         if lang not in ("en", "it"):
             lang = "it"
 
         try:
-            tools, stores_used = self._build_tools(domain=domain, store_ids=store_ids)
-
-            config = types.GenerateContentConfig(
-                tools=tools if tools else None,
-                automatic_function_calling=types.AutomaticFunctionCallingConfig(disable=False),
-                temperature=0.7,
-                system_instruction=self._system_instruction(lang),
-            )
+            tools, stores_used = await self._build_tools(domain=domain, store_ids=store_ids)
+
+            # Reuse the session from the previous turn of this conversation, if any
+            session_key = None
+            chat_session = None
+            if conversation_id:
+                session_key = (conversation_id, lang, tuple(sorted(stores_used)))
+                chat_session = self._get_cached_session(session_key)
+
+            if chat_session is None:
+                config = types.GenerateContentConfig(
+                    tools=tools if tools else None,
+                    automatic_function_calling=types.AutomaticFunctionCallingConfig(disable=False),
+                    temperature=0.7,
+                    system_instruction=self._system_instruction(lang),
+                )
 
-            chat_session = self.client.chats.create(
-                model=MODEL,
-                config=config,
-            )
+                # The SDK chat calls are blocking; run them in a worker thread so
+                # concurrent requests do not serialize on the event loop.
+                chat_session = await asyncio.to_thread(
+                    self.client.chats.create,
+                    model=MODEL,
+                    config=config,
+                )
+                if session_key is not None:
+                    self._store_session(session_key, chat_session)
 
             logger.info(
                 f"Sending message to Gemini. domain={domain}, store_ids={store_ids}, "
                 f"stores_used={stores_used}, tools={len(tools) > 0}"
             )
-            response = chat_session.send_message(message)
+            async with _gemini_sem:
+                response = await with_retry(
+                    lambda: asyncio.to_thread(chat_session.send_message, message)
+                )
+            gemini_breaker.record_success()
 
             if not response:
                 logger.error("No response object returned from Gemini")
@@ -263,9 +433,131 @@ class UniVRAgent:
                 "stores_used": stores_used,
             }
         except Exception as e:
+            if is_retryable(e):
+                gemini_breaker.record_failure()
             logger.error(f"Gemini API error during chat: {e}", exc_info=True)
             return self._demo_response(message)
 
+    async def chat_stream(
+        self,
+        message: str,
+        domain: Optional[str] = None,
+        store_ids: Optional[list[str]] = None,
+        language: Optional[str] = None,
+        conversation_id: Optional[str] = None,
+    ):
+        """
+        Stream a response as it is generated.
+
+        Yields {"delta": text} for each Gemini chunk, then one final dict
+        with 'response' (full text), 'sources', 'links', 'stores_used'.
+        Arguments match chat(); on error the demo response is yielded whole.
+        """
+        if not self.client and GEMINI_API_KEY:
+            logger.info("Client not initialized, attempting to initialize now...")
+            self._initialize()
+
+        if not self.client:
+            logger.warning("Running in demo mode - client not available")
+            demo = self._demo_response(message)
+            yield {"delta": demo["response"]}
+            yield demo
+            return
+
+        if gemini_breaker.is_open():
+            logger.warning("Gemini circuit open; serving demo response without a round-trip")
+            demo = self._demo_response(message)
+            yield {"delta": demo["response"]}
+            yield demo
+            return
+
+        lang = (language or "it").strip().lower()
+        if lang not in ("en", "it"):
+            lang = "it"
+
+        try:
+            tools, stores_used = await self._build_tools(domain=domain, store_ids=store_ids)
+
+            session_key = None
+            chat_session = None
+            if conversation_id:
+                session_key = (conversation_id, lang, tuple(sorted(stores_used)))
+                chat_session = self._get_cached_session(session_key)
+
+            if chat_session is None:
+                config = types.GenerateContentConfig(
+                    tools=tools if tools else None,
+                    automatic_function_calling=types.AutomaticFunctionCallingConfig(disable=False),
+                    temperature=0.7,
+                    system_instruction=self._system_instruction(lang),
+                )
+                chat_session = await asyncio.to_thread(
+                    self.client.chats.create,
+                    model=MODEL,
+                    config=config,
+                )
+                if session_key is not None:
+                    self._store_session(session_key, chat_session)
+
+            logger.info(
+                f"Streaming message to Gemini. domain={domain}, store_ids={store_ids}, "
+                f"stores_used={stores_used}, tools={len(tools) > 0}"
+            )
+
+            # The sync SDK iterator blocks between chunks; pump it in a worker
+            # thread and hand chunks to the event loop through a queue
+            queue: asyncio.Queue = asyncio.Queue()
+            loop = asyncio.get_running_loop()
+            done = object()
+
+            def _pump():
+                try:
+                    for chunk in chat_session.send_message_stream(message):
+                        loop.call_soon_threadsafe(queue.put_nowait, chunk)
+                    loop.call_soon_threadsafe(queue.put_nowait, done)
+                except BaseException as e:
+                    loop.call_soon_threadsafe(queue.put_nowait, e)
+
+            async with _gemini_sem:
+                pump_task = asyncio.create_task(asyncio.to_thread(_pump))
+                parts: list[str] = []
+                grounded = None
+                while True:
+                    item = await queue.get()
+                    if item is done:
+                        break
+                    if isinstance(item, BaseException):
+                        raise item
+                    if item.candidates and item.candidates[0].grounding_metadata:
+                        grounded = item
+                    text = getattr(item, "text", None)
+                    if text:
+                        parts.append(text)
+                        yield {"delta": text}
+                await pump_task
+
+            gemini_breaker.record_success()
+            response_text = "".join(parts)
+            if not response_text:
+                raise ValueError("Empty streamed response text")
+
+            sources, links = (
+                self._extract_sources_and_links(grounded) if grounded else ([], [])
+            )
+            yield {
+                "response": response_text,
+                "sources": sources,
+                "links": links,
+                "stores_used": stores_used,
+            }
+        except Exception as e:
+            if is_retryable(e):
+                gemini_breaker.record_failure()
+            logger.error(f"Gemini API error during streaming chat: {e}", exc_info=True)
+            demo = self._demo_response(message)
+            yield {"delta": demo["response"]}
+            yield demo
+
     async def generate_follow_up_suggestions(
         self,
         user_message: str,
@@ -276,43 +568,52 @@ class UniVRAgent:
         Generate 2–3 short follow-up questions based on the Q&A, in the requested language.
         Returns a list of question strings (empty on error or no client).
         """
-        if not self.client:
+        if not self.client or gemini_breaker.is_open():
             return []
         lang = (language or "it").strip().lower()
         if lang not in ("en", "it"):
             lang = "it"
-        if lang == "en":
-            prompt = """Based on this Q&A about ULSS 9 Scaligera healthcare services, suggest exactly 3 short follow-up questions the user might ask next.
-Return ONLY the 3 questions, one per line. No numbering, no bullets. Keep each question under 15 words.
-Language: English only.
+        answer = bot_response[:1500]
 
-User question:
-"""
-            prompt += f"{user_message}\n\nAnswer:\n{bot_response[:1500]}"
-        else:
-            prompt = """In base a questa domanda e risposta sull'assistente ULSS 9 Scaligera, suggerisci esattamente 3 brevi domande di seguito che l'utente potrebbe fare.
-Rispondi SOLO con le 3 domande, una per riga. Niente numeri, niente elenchi. Ogni domanda max 15 parole.
-Lingua: solo italiano.
+        # Repeat Q&A pairs (e.g. the welcome suggestions) reuse the cached result
+        digest = hashlib.sha256(f"{user_message}\n{answer}".encode("utf-8")).digest()
+        cache_key = (lang, digest)
+        cached = self._followup_cache.get(cache_key)
+        if cached is not None:
+            self._followup_cache.move_to_end(cache_key)
+            return list(cached)
 
-Domanda dell'utente:
-"""
-            prompt += f"{user_message}\n\nRisposta:\n{bot_response[:1500]}"
+        if lang == "en":
+            prompt = f"{FOLLOWUP_PROMPT_EN}{user_message}\n\nAnswer:\n{answer}"
+        else:
+            prompt = f"{FOLLOWUP_PROMPT_IT}{user_message}\n\nRisposta:\n{answer}"
         try:
-            response = await asyncio.to_thread(
-                lambda: self.client.models.generate_content(
-                    model=MODEL,
-                    contents=prompt,
-                    config=types.GenerateContentConfig(temperature=0.5),
+            async with _gemini_sem:
+                response = await with_retry(
+                    lambda: asyncio.to_thread(
+                        lambda: self.client.models.generate_content(
+                            model=MODEL,
+                            contents=prompt,
+                            config=types.GenerateContentConfig(temperature=0.5),
+                        )
+                    ),
+                    retries=2,
                 )
-            )
+            gemini_breaker.record_success()
             text = (response.text or "").strip()
             questions = [
                 q.strip()
                 for q in text.split("\n")
                 if q.strip() and len(q.strip()) > 5
             ][:3]
+            if questions:
+                self._followup_cache[cache_key] = questions
+                if len(self._followup_cache) > FOLLOWUP_CACHE_MAX:
+                    self._followup_cache.popitem(last=False)
             return questions
         except Exception as e:
+            if is_retryable(e):
+                gemini_breaker.record_failure()
             logger.warning(f"Follow-up suggestions generation failed: {e}")
             return []
 
@@ -4,16 +4,21 @@ UniVR Chatbot - Admin API Endpoints
 Manage File Search Stores (domains) and documents.
 """
 
+import asyncio
+import hashlib
 import logging
+import sqlite3
 from pathlib import Path
 
+import aiofiles
 from fastapi import APIRouter, Depends, UploadFile, File, HTTPException
 from pydantic import BaseModel
 
 from app.api.auth import require_admin
+from app.api.chat import agent, clear_response_caches
 from app.config import ULSS9_STORES
 from app.services.extra_stores import set_extra_description
-from app.services.store_manager import StoreManager, StoreInfo
+from app.services.store_manager import StoreManager, StoreInfo, invalidate_store_list_cache
 
 logger = logging.getLogger(__name__)
 
@@ -23,6 +28,75 @@ router = APIRouter()
 DATA_DIR = Path(__file__).resolve().parent.parent.parent / "data" / "uploads"
 DATA_DIR.mkdir(parents=True, exist_ok=True)
 
+# Uploads are streamed to disk in chunks, so memory stays bounded by
+# UPLOAD_CHUNK_SIZE instead of the whole file
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1 MiB
+MAX_UPLOAD_BYTES = 50 * (1 << 20)  # 50 MB
+
+# Accepted upload extensions (matched case-insensitively, so .PDF works too)
+ALLOWED_UPLOAD_EXTS = frozenset({".pdf", ".md", ".txt", ".docx"})
+
+# Local index of already-uploaded content: re-uploading an unchanged file
+# returns the cached result instead of re-running the Gemini upload+indexing.
+UPLOAD_CACHE_DB = DATA_DIR.parent / ".upload_cache.sqlite"
+
+
+def _upload_cache_conn() -> sqlite3.Connection:
+    conn = sqlite3.connect(UPLOAD_CACHE_DB)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS uploads("
+        "key TEXT PRIMARY KEY, domain TEXT, document_id TEXT, title TEXT)"
+    )
+    return conn
+
+
+def _upload_cache_get(key: str) -> tuple[str | None, str | None] | None:
+    """Return (document_id, title) for a known upload key, or None."""
+    conn = _upload_cache_conn()
+    try:
+        return conn.execute(
+            "SELECT document_id, title FROM uploads WHERE key = ?", (key,)
+        ).fetchone()
+    finally:
+        conn.close()
+
+
+def _upload_cache_put(key: str, domain: str, document_id: str | None, title: str | None) -> None:
+    conn = _upload_cache_conn()
+    try:
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO uploads(key, domain, document_id, title) VALUES (?, ?, ?, ?)",
+                (key, domain, document_id, title),
+            )
+    finally:
+        conn.close()
+
+
+def _upload_cache_clear(domain: str | None = None) -> None:
+    """Drop cached upload keys (for one domain, or all) after store mutations."""
+    conn = _upload_cache_conn()
+    try:
+        with conn:
+            if domain is None:
+                conn.execute("DELETE FROM uploads")
+            else:
+                conn.execute("DELETE FROM uploads WHERE domain = ?", (domain,))
+    finally:
+        conn.close()
+
+# Process-wide StoreManager so admin requests reuse one Gemini client
+# (and its HTTPS connection pool) instead of rebuilding it per call.
+_store_manager: StoreManager | None = None
+
+
+def get_store_manager() -> StoreManager:
+    """Dependency: lazily constructed shared StoreManager."""
+    global _store_manager
+    if _store_manager is None:
+        _store_manager = StoreManager()
+    return _store_manager
+
 
 # ============ Schemas ============
 
@@ -50,6 +124,12 @@ class UploadResponse(BaseModel):
     title: str | None = None
 
 
+class BatchUploadResponse(BaseModel):
+    """Batch upload response: per-file results with partial-failure semantics."""
+    success: bool
+    results: list[UploadResponse]
+
+
 class DocumentInfo(BaseModel):
     """Document information schema."""
     name: str
@@ -60,17 +140,23 @@ class DocumentInfo(BaseModel):
 # ============ Store Management ============
 
 @router.post("/stores", response_model=CreateStoreResponse)
-async def create_store(request: CreateStoreRequest, _: str = Depends(require_admin)):
+async def create_store(
+    request: CreateStoreRequest,
+    _: str = Depends(require_admin),
+    store_manager: StoreManager = Depends(get_store_manager),
+):
     """
     Create a new File Search Store (category) for RAG.
     Use for stores beyond the four initial areas (Allegato A).
     Saves the description so store selection can include this category.
     """
     try:
-        store_manager = StoreManager()
         store = await store_manager.create_store(request.domain, request.description)
         if request.description:
             set_extra_description(request.domain, request.description)
+        agent.invalidate_store_cache(request.domain)
+        invalidate_store_list_cache()
+        clear_response_caches()
         return CreateStoreResponse(
             success=True,
             domain=request.domain,
@@ -83,11 +169,14 @@ async def create_store(request: CreateStoreRequest, _: str = Depends(require_adm
 
 
 @router.get("/stores", response_model=list[StoreInfo])
-async def list_stores(_: str = Depends(require_admin)):
-    """List all available stores/domains."""
+async def list_stores(
+    include_counts: bool = False,
+    _: str = Depends(require_admin),
+    store_manager: StoreManager = Depends(get_store_manager),
+):
+    """List all available stores/domains. Pass include_counts=1 for document counts."""
     try:
-        store_manager = StoreManager()
-        stores = await store_manager.list_stores()
+        stores = await store_manager.list_stores(include_counts=include_counts)
         return stores
     except Exception as e:
         logger.error(f"List stores error: {e}")
@@ -95,15 +184,22 @@ async def list_stores(_: str = Depends(require_admin)):
 
 
 @router.delete("/stores/{domain}")
-async def delete_store(domain: str, _: str = Depends(require_admin)):
+async def delete_store(
+    domain: str,
+    _: str = Depends(require_admin),
+    store_manager: StoreManager = Depends(get_store_manager),
+):
     """Delete a store and all its documents."""
     try:
-        store_manager = StoreManager()
         success = await store_manager.delete_store(domain)
 
         if not success:
             raise HTTPException(status_code=404, detail=f"Store '{domain}' not found")
 
+        agent.invalidate_store_cache(domain)
+        invalidate_store_list_cache()
+        clear_response_caches()
+        _upload_cache_clear(domain)
         return {"success": True, "message": f"Store '{domain}' deleted"}
     except HTTPException:
         raise
@@ -113,23 +209,40 @@ async def delete_store(domain: str, _: str = Depends(require_admin)):
 
 
 @router.post("/stores/delete-all")
-async def delete_all_stores(_: str = Depends(require_admin)):
+async def delete_all_stores(
+    _: str = Depends(require_admin),
+    store_manager: StoreManager = Depends(get_store_manager),
+):
     """
     Delete all File Search Stores (with the app's STORE_PREFIX) from Gemini.
     Use this to clear everything before creating the 4 ULSS 9 stores.
     """
     try:
-        store_manager = StoreManager()
-        stores = await store_manager.list_stores()
-        deleted = []
-        for s in stores:
-            try:
-                ok = await store_manager.delete_store(s.domain)
-                if ok:
-                    deleted.append(s.domain)
-                    logger.info(f"Deleted store: {s.domain}")
-            except Exception as e:
-                logger.warning(f"Failed to delete store {s.domain}: {e}")
+        # A primed agent store cache already knows every domain; skip the list RPC
+        domains = agent.cached_store_domains()
+        if domains is None:
+            stores = await store_manager.list_stores()
+            domains = [s.domain for s in stores]
+
+        # Fan deletions out concurrently, bounded so we don't hammer Gemini
+        sem = asyncio.Semaphore(8)
+
+        async def _delete_one(domain: str) -> str | None:
+            async with sem:
+                try:
+                    if await store_manager.delete_store(domain):
+                        logger.info(f"Deleted store: {domain}")
+                        return domain
+                except Exception as e:
+                    logger.warning(f"Failed to delete store {domain}: {e}")
+                return None
+
+        results = await asyncio.gather(*(_delete_one(d) for d in domains))
+        deleted = [d for d in results if d]
+        agent.invalidate_store_cache()
+        invalidate_store_list_cache()
+        clear_response_caches()
+        _upload_cache_clear()
         return {
             "success": True,
             "message": f"Deleted {len(deleted)} store(s) from Gemini.",
@@ -141,16 +254,23 @@ async def delete_all_stores(_: str = Depends(require_admin)):
 
 
 @router.post("/stores/ulss9/create-all")
-async def create_all_ulss9_stores(_: str = Depends(require_admin)):
+async def create_all_ulss9_stores(
+    _: str = Depends(require_admin),
+    store_manager: StoreManager = Depends(get_store_manager),
+):
     """Create the four initial stores from Allegato A (idempotent). Others can be added via POST /stores."""
     try:
-        store_manager = StoreManager()
-        created = []
-        for s in ULSS9_STORES:
-            domain = s["id"]
-            desc = s.get("description", "")
-            store = await store_manager.create_store(domain, desc)
-            created.append({"domain": domain, "store_name": store.name})
+        # Create the four stores concurrently: bootstrap takes one RTT, not four
+        stores = await asyncio.gather(
+            *(store_manager.create_store(s["id"], s.get("description", "")) for s in ULSS9_STORES)
+        )
+        created = [
+            {"domain": s["id"], "store_name": store.name}
+            for s, store in zip(ULSS9_STORES, stores)
+        ]
+        agent.invalidate_store_cache()
+        invalidate_store_list_cache()
+        clear_response_caches()
         return {"success": True, "message": "ULSS 9 stores ensured", "stores": created}
     except Exception as e:
         logger.error(f"Create all ULSS9 stores error: {e}")
@@ -164,6 +284,7 @@ async def upload_document(
     domain: str,
     file: UploadFile = File(...),
     _: str = Depends(require_admin),
+    store_manager: StoreManager = Depends(get_store_manager),
 ):
     """
     Upload a document to a domain's File Search Store.
@@ -172,26 +293,56 @@ async def upload_document(
     """
     try:
         # Validate file type
-        if not file.filename.endswith((".pdf", ".md", ".txt", ".docx")):
+        if Path(file.filename or "").suffix.lower() not in ALLOWED_UPLOAD_EXTS:
             raise HTTPException(
                 status_code=400,
                 detail="Only PDF, Markdown, TXT, and DOCX files are supported"
             )
         
-        # Save the file locally
+        # Stream the file to disk in chunks (never the whole upload in RAM),
+        # hashing as we go so unchanged content can skip the Gemini upload
         file_path = DATA_DIR / file.filename
-        content = await file.read()
-        file_path.write_bytes(content)
-        
-        logger.info(f"Saved file: {file_path}")
+        size = 0
+        hasher = hashlib.blake2b(digest_size=16)
+        try:
+            async with aiofiles.open(file_path, "wb") as out:
+                while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > MAX_UPLOAD_BYTES:
+                        raise HTTPException(
+                            status_code=413,
+                            detail="File too large (max 50 MB)"
+                        )
+                    hasher.update(chunk)
+                    await out.write(chunk)
+        except HTTPException:
+            file_path.unlink(missing_ok=True)
+            raise
+
+        logger.info(f"Saved file: {file_path} ({size} bytes)")
+
+        cache_key = f"{domain}:{file.filename}:{size}:{hasher.hexdigest()}"
+        cached = _upload_cache_get(cache_key)
+        if cached:
+            logger.info(f"Upload of '{file.filename}' unchanged, skipping Gemini re-upload")
+            return UploadResponse(
+                success=True,
+                filename=file.filename,
+                domain=domain,
+                message=f"Document '{file.filename}' unchanged, already in '{domain}' domain",
+                document_id=cached[0],
+                title=cached[1],
+            )
         
         # Upload to File Search Store (attached doc: source_type=attachment, document_id for links)
-        store_manager = StoreManager()
         result = await store_manager.upload_document(
             str(file_path),
             domain,
             source_type="attachment",
         )
+        _upload_cache_put(cache_key, domain, result.get("document_id"), result.get("title"))
+        invalidate_store_list_cache()  # document counts changed
+        clear_response_caches()
         return UploadResponse(
             success=True,
             filename=file.filename,
@@ -210,11 +361,78 @@ async def upload_document(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/stores/{domain}/upload-batch", response_model=BatchUploadResponse)
+async def upload_documents_batch(
+    domain: str,
+    files: list[UploadFile] = File(...),
+    _: str = Depends(require_admin),
+    store_manager: StoreManager = Depends(get_store_manager),
+):
+    """
+    Upload several documents to a domain's store in one request.
+
+    Files are processed concurrently (bounded to respect Gemini rate limits)
+    and each gets its own result; one failing file does not abort the rest.
+    """
+    # Bound concurrent Gemini uploads; all share one client/connection pool
+    sem = asyncio.Semaphore(4)
+
+    async def _upload_one(file: UploadFile) -> UploadResponse:
+        filename = file.filename or ""
+        if Path(filename).suffix.lower() not in ALLOWED_UPLOAD_EXTS:
+            return UploadResponse(
+                success=False,
+                filename=filename,
+                domain=domain,
+                message="Only PDF, Markdown, TXT, and DOCX files are supported",
+            )
+        async with sem:
+            file_path = DATA_DIR / filename
+            try:
+                size = 0
+                async with aiofiles.open(file_path, "wb") as out:
+                    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                        size += len(chunk)
+                        if size > MAX_UPLOAD_BYTES:
+                            raise ValueError("File too large (max 50 MB)")
+                        await out.write(chunk)
+                result = await store_manager.upload_document(
+                    str(file_path),
+                    domain,
+                    source_type="attachment",
+                )
+                return UploadResponse(
+                    success=True,
+                    filename=filename,
+                    domain=domain,
+                    message=f"Document '{filename}' uploaded to '{domain}' domain",
+                    document_id=result.get("document_id"),
+                    title=result.get("title"),
+                )
+            except Exception as e:
+                logger.error(f"Batch upload failed for '{filename}': {e}")
+                file_path.unlink(missing_ok=True)
+                return UploadResponse(
+                    success=False,
+                    filename=filename,
+                    domain=domain,
+                    message=str(e),
+                )
+
+    results = await asyncio.gather(*(_upload_one(f) for f in files))
+    if any(r.success for r in results):
+        invalidate_store_list_cache()  # document counts changed
+        clear_response_caches()
+    return BatchUploadResponse(
+        success=all(r.success for r in results),
+        results=list(results),
+    )
+
+
 @router.get("/stores/{domain}/documents", response_model=list[DocumentInfo])
-async def list_documents(domain: str):
+async def list_documents(domain: str, store_manager: StoreManager = Depends(get_store_manager)):
     """List all documents in a domain's store."""
     try:
-        store_manager = StoreManager()
         documents = await store_manager.list_documents(domain)
         return documents
     except Exception as e:
@@ -223,15 +441,25 @@ async def list_documents(domain: str):
 
 
 @router.delete("/stores/{domain}/documents/{doc_name:path}")
-async def delete_document(domain: str, doc_name: str, _: str = Depends(require_admin)):
+async def delete_document(
+    domain: str,
+    doc_name: str,
+    _: str = Depends(require_admin),
+    store_manager: StoreManager = Depends(get_store_manager),
+):
     """Delete a document from a domain's store."""
     try:
-        store_manager = StoreManager()
         success = await store_manager.delete_document(domain, doc_name)
         
         if not success:
             raise HTTPException(status_code=404, detail="Document not found")
-        
+
+        # The dedup cache key cannot be derived from doc_name, so drop the
+        # whole domain's entries — otherwise re-uploading the same bytes
+        # would be "skipped" even though the document is gone
+        _upload_cache_clear(domain)
+        invalidate_store_list_cache()  # document counts changed
+        clear_response_caches()
         return {"success": True, "message": "Document deleted"}
     except HTTPException:
         raise
@@ -3,6 +3,8 @@ Admin auth: login only, no registration.
 Single user validated against bcrypt hash; JWT returned for admin API access.
 """
 
+import functools
+import hashlib
 import logging
 from datetime import datetime, timedelta, timezone
 
@@ -36,11 +38,26 @@ class LoginResponse(BaseModel):
     username: str
 
 
+# Memoized bcrypt verdicts keyed by (sha256 of plaintext, hash), so repeated
+# logins with the same credentials skip the deliberately slow bcrypt check.
+# The digest key avoids keeping plaintext passwords in memory.
+_VERIFY_CACHE_MAX = 64
+_verify_cache: dict[tuple[bytes, str], bool] = {}
+
+
 def _verify_password(plain: str, hashed: str) -> bool:
+    key = (hashlib.sha256(plain.encode("utf-8")).digest(), hashed)
+    cached = _verify_cache.get(key)
+    if cached is not None:
+        return cached
     try:
-        return bcrypt.checkpw(plain.encode("utf-8"), hashed.encode("utf-8"))
+        ok = bcrypt.checkpw(plain.encode("utf-8"), hashed.encode("utf-8"))
     except Exception:
         return False
+    if len(_verify_cache) >= _VERIFY_CACHE_MAX:
+        _verify_cache.clear()
+    _verify_cache[key] = ok
+    return ok
 
 
 def _create_token(username: str) -> str:
@@ -64,6 +81,19 @@ async def login(body: LoginRequest):
     return LoginResponse(token=token, username=body.username)
 
 
+@functools.lru_cache(maxsize=256)
+def _decode_token_cached(token: str) -> dict:
+    """
+    Verify signature and decode once per token (tokens live JWT_EXPIRE_HOURS,
+    so a hot admin token is verified once per process). Expiry is NOT checked
+    here — the caller re-checks it on every request so a cached decode can
+    never keep an expired token alive.
+    """
+    return jwt.decode(
+        token, JWT_SECRET, algorithms=[JWT_ALGORITHM], options={"verify_exp": False}
+    )
+
+
 def require_admin(
     credentials: HTTPAuthorizationCredentials | None = Depends(security),
 ) -> str:
@@ -71,14 +101,13 @@ def require_admin(
     if not credentials or credentials.credentials is None:
         raise HTTPException(status_code=401, detail="Missing or invalid authorization")
     try:
-        payload = jwt.decode(
-            credentials.credentials, JWT_SECRET, algorithms=[JWT_ALGORITHM]
-        )
-        username = payload.get("sub")
-        if not username or username != ADMIN_USERNAME:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        return username
-    except jwt.ExpiredSignatureError:
-        raise HTTPException(status_code=401, detail="Token expired")
+        payload = _decode_token_cached(credentials.credentials)
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
+    exp = payload.get("exp")
+    if exp is None or datetime.now(timezone.utc).timestamp() >= exp:
+        raise HTTPException(status_code=401, detail="Token expired")
+    username = payload.get("sub")
+    if not username or username != ADMIN_USERNAME:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    return username
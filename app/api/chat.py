@@ -7,15 +7,21 @@ When domain is set: single-store RAG (backward compatibility).
 
 import asyncio
 import logging
+import re
+from collections import OrderedDict
 from typing import Optional
 
+import orjson
 from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pydantic import BaseModel
 
 from app.agents.univr_agent import UniVRAgent
 from app.config import ALLOW_ENGLISH, GEMINI_API_KEY, ULSS9_STORES
-from app.services.extra_stores import get_extra_description
-from app.services.store_manager import StoreManager
+from app.services.batcher import Coalescer
+from app.services.extra_stores import get_extra_descriptions
+from app.services.semantic_cache import ProximityCache, embed_query
+from app.services.store_manager import list_stores_cached
 from app.services.store_selector import select_stores_for_query
 
 logger = logging.getLogger(__name__)
@@ -25,6 +31,54 @@ router = APIRouter()
 # Initialize the agent (singleton)
 agent = UniVRAgent()
 
+# Ids of the four initial stores (Allegato A), computed once at import
+_INITIAL_IDS: frozenset[str] = frozenset(s["id"] for s in ULSS9_STORES)
+
+# Demo/error stub detection: one C-level scan instead of .lower() plus two
+# substring passes over potentially multi-KB responses
+_DEMO_RE = re.compile(r"demo mode|⚠️", re.IGNORECASE)
+
+# Semantic caches (one per language): near-duplicate messages reuse the
+# previously assembled response without any Gemini calls
+_semantic_caches: dict[str, ProximityCache] = {}
+
+
+def _semantic_cache_for(lang: str) -> ProximityCache:
+    cache = _semantic_caches.get(lang)
+    if cache is None:
+        cache = _semantic_caches[lang] = ProximityCache()
+    return cache
+
+
+# Concurrent identical stateless chats share one in-flight Gemini call
+_chat_coalescer = Coalescer()
+
+# Exact-repeat stage ahead of the semantic cache: users often send the same
+# text verbatim (welcome suggestions, pasted FAQ questions), and a dict hit
+# on (normalized message, lang) costs nothing — not even the embedding call
+EXACT_CACHE_MAX = 1024
+_exact_cache: OrderedDict[tuple[str, str], dict] = OrderedDict()
+
+
+def _exact_cache_get(key: tuple[str, str]) -> dict | None:
+    payload = _exact_cache.get(key)
+    if payload is not None:
+        _exact_cache.move_to_end(key)
+    return payload
+
+
+def _exact_cache_put(key: tuple[str, str], payload: dict) -> None:
+    _exact_cache[key] = payload
+    if len(_exact_cache) > EXACT_CACHE_MAX:
+        _exact_cache.popitem(last=False)
+
+
+def clear_response_caches() -> None:
+    """Drop exact and semantic response caches (store registry/content changed)."""
+    _exact_cache.clear()
+    for cache in _semantic_caches.values():
+        cache.clear()
+
 
 class ChatRequest(BaseModel):
     """Chat request schema."""
@@ -69,93 +123,243 @@ async def chat(request: ChatRequest):
         if not ALLOW_ENGLISH:
             lang = "it"
 
+        # Semantic cache applies only to the stateless multi-store flow:
+        # a set domain (legacy path) or a conversation id (multi-turn
+        # context) changes what a correct answer looks like.
+        use_semantic_cache = (
+            not request.domain and not request.conversation_id and agent.client is not None
+        )
+        query_vec = None
+
+        exact_key = None
+        if use_semantic_cache:
+            exact_key = (request.message.strip().lower(), lang)
+            exact_hit = _exact_cache_get(exact_key)
+            if exact_hit is not None:
+                logger.info("Exact-match cache hit, skipping Gemini calls")
+                return ORJSONResponse(exact_hit)
+
         if request.domain:
             # Single store (legacy / testing)
             result = await agent.chat(
                 message=request.message,
                 domain=request.domain,
                 language=lang,
+                conversation_id=request.conversation_id,
             )
         else:
             # ULSS 9 flow: store selection (four initial + extra from API) then multi-store RAG
-            store_manager = StoreManager()
-            existing_stores = await store_manager.list_stores()
-            initial_ids = {s["id"] for s in ULSS9_STORES}
+            # Overlap the query embedding with the store-list fetch
+            embed_task = (
+                asyncio.create_task(embed_query(agent.client, request.message))
+                if use_semantic_cache
+                else None
+            )
+            existing_stores = await list_stores_cached()
+            if embed_task is not None:
+                query_vec = await embed_task
+                if query_vec is not None:
+                    cached = _semantic_cache_for(lang).lookup(query_vec)
+                    if cached is not None:
+                        logger.info("Semantic cache hit, skipping Gemini calls")
+                        return ORJSONResponse(cached)
+            extra_descriptions = get_extra_descriptions()
             extra_stores = [
                 {
                     "id": s.domain,
-                    "description": get_extra_description(s.domain) or s.display_name or s.domain,
+                    "description": extra_descriptions.get(s.domain) or s.display_name or s.domain,
                 }
                 for s in existing_stores
-                if s.domain not in initial_ids
+                if s.domain not in _INITIAL_IDS
             ]
             selected_ids = await select_stores_for_query(
                 agent.client,
                 request.message,
                 extra_stores=extra_stores if extra_stores else None,
             )
-            result = await agent.chat(
-                message=request.message,
-                store_ids=selected_ids,
-                language=lang,
-            )
+            def _run_chat():
+                return agent.chat(
+                    message=request.message,
+                    store_ids=selected_ids,
+                    language=lang,
+                    conversation_id=request.conversation_id,
+                )
 
-        if "demo mode" in result.get("response", "").lower() or "⚠️" in result.get("response", ""):
-            logger.warning(f"Received demo response. Client initialized: {agent.client is not None}")
+            if request.conversation_id:
+                # Multi-turn: each conversation has its own session state
+                result = await _run_chat()
+            else:
+                result = await _chat_coalescer.run(
+                    (request.message, lang, tuple(selected_ids)), _run_chat
+                )
 
-        suggested_questions: list[str] = []
-        if agent.client:
-            try:
-                suggested_questions = await agent.generate_follow_up_suggestions(
+        resp_text = result.get("response", "")
+        is_demo = _DEMO_RE.search(resp_text) is not None
+
+        # Start follow-up generation immediately; the payload assembly below
+        # overlaps with the Gemini call. Demo/error stubs skip the call —
+        # suggestions for a stub are wasted — and fall back to the generic
+        # welcome suggestions so the UI still renders three prompts.
+        suggestion_task = (
+            asyncio.create_task(
+                agent.generate_follow_up_suggestions(
                     user_message=request.message,
                     bot_response=result["response"],
                     language=lang,
                 )
+            )
+            if agent.client and not is_demo
+            else None
+        )
+
+        if is_demo:
+            logger.warning(f"Received demo response. Client initialized: {agent.client is not None}")
+
+        suggested_questions: list[str] = []
+        if is_demo:
+            content = WELCOME_EN if lang == "en" else WELCOME_IT
+            suggested_questions = list(content["suggestions"])
+        elif suggestion_task is not None:
+            try:
+                suggested_questions = await suggestion_task
             except Exception as e:
                 logger.warning(f"Follow-up suggestions failed: {e}")
 
-        return ChatResponse(
-            response=result["response"],
-            sources=result.get("sources", []),
-            links=result.get("links", []),
-            stores_used=result.get("stores_used", []),
-            domain=request.domain,
-            suggested_questions=suggested_questions,
-        )
+        payload = {
+            "response": result["response"],
+            "sources": result.get("sources", []),
+            "links": result.get("links", []),
+            "stores_used": result.get("stores_used", []),
+            "domain": request.domain,
+            "suggested_questions": suggested_questions,
+        }
+        if not is_demo:
+            if exact_key is not None:
+                _exact_cache_put(exact_key, payload)
+            if use_semantic_cache and query_vec is not None:
+                _semantic_cache_for(lang).add(query_vec, payload)
+        # The payload is built entirely under our control and ChatResponse
+        # documents the schema; returning a Response skips FastAPI's full
+        # pydantic re-validation of the (potentially long) source lists
+        return ORJSONResponse(payload)
     except Exception as e:
         logger.error(f"Chat error: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def _select_store_ids(message: str) -> list[str]:
+    """Store selection for the multi-store flow (four initial + extra from API)."""
+    existing_stores = await list_stores_cached()
+    extra_descriptions = get_extra_descriptions()
+    extra_stores = [
+        {
+            "id": s.domain,
+            "description": extra_descriptions.get(s.domain) or s.display_name or s.domain,
+        }
+        for s in existing_stores
+        if s.domain not in _INITIAL_IDS
+    ]
+    return await select_stores_for_query(
+        agent.client,
+        message,
+        extra_stores=extra_stores if extra_stores else None,
+    )
+
+
+def _sse(payload: dict) -> str:
+    """Format one Server-Sent Events message."""
+    return f"data: {orjson.dumps(payload).decode()}\n\n"
+
+
+@router.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """
+    Stream the chatbot answer as Server-Sent Events.
+
+    Emits data: {"delta": ...} events as Gemini tokens arrive, then a final
+    data: {...} event shaped like ChatResponse (sources, links, stores_used,
+    suggested_questions). Store selection happens before the stream starts.
+    """
+    lang = (request.language or "it").strip().lower()
+    if lang not in ("en", "it"):
+        lang = "it"
+    if not ALLOW_ENGLISH:
+        lang = "it"
+
+    selected_ids = None if request.domain else await _select_store_ids(request.message)
+
+    async def event_generator():
+        try:
+            final = None
+            async for event in agent.chat_stream(
+                message=request.message,
+                domain=request.domain,
+                store_ids=selected_ids,
+                language=lang,
+                conversation_id=request.conversation_id,
+            ):
+                if "delta" in event:
+                    yield _sse(event)
+                else:
+                    final = event
+
+            resp_text = (final or {}).get("response", "")
+            is_demo = _DEMO_RE.search(resp_text) is not None
+
+            suggested_questions: list[str] = []
+            if is_demo:
+                content = WELCOME_EN if lang == "en" else WELCOME_IT
+                suggested_questions = list(content["suggestions"])
+            elif agent.client and resp_text:
+                try:
+                    suggested_questions = await agent.generate_follow_up_suggestions(
+                        user_message=request.message,
+                        bot_response=resp_text,
+                        language=lang,
+                    )
+                except Exception as e:
+                    logger.warning(f"Follow-up suggestions failed: {e}")
+
+            yield _sse({
+                "response": resp_text,
+                "sources": (final or {}).get("sources", []),
+                "links": (final or {}).get("links", []),
+                "stores_used": (final or {}).get("stores_used", []),
+                "domain": request.domain,
+                "suggested_questions": suggested_questions,
+            })
+        except Exception as e:
+            logger.error(f"Chat stream error: {e}", exc_info=True)
+            yield _sse({"error": str(e)})
+
+    return StreamingResponse(event_generator(), media_type="text/event-stream")
+
+
 @router.get("/domains", response_model=list[DomainInfo])
 async def get_domains():
     """Get list of stores: four initial (Allegato A) + any added via API, with document_count."""
     try:
-        store_manager = StoreManager()
-        existing = await store_manager.list_stores()
+        existing = await list_stores_cached()
         by_domain = {s.domain: s for s in existing}
 
-        result = []
-        for s in ULSS9_STORES:
-            sid = s["id"]
-            info = by_domain.get(sid)
-            doc_count = info.document_count if info else 0
-            result.append(
-                DomainInfo(
-                    domain=sid,
-                    display_name=f"ulss9-{sid}",
-                    document_count=doc_count,
-                )
+        # Initial stores first (zero count when not yet created), then extras
+        result = [
+            DomainInfo(
+                domain=s["id"],
+                display_name=f"ulss9-{s['id']}",
+                document_count=getattr(by_domain.get(s["id"]), "document_count", 0),
             )
-        for s in existing:
-            if s.domain not in {x["id"] for x in ULSS9_STORES}:
-                result.append(
-                    DomainInfo(
-                        domain=s.domain,
-                        display_name=s.display_name or s.domain,
-                        document_count=s.document_count,
-                    )
-                )
+            for s in ULSS9_STORES
+        ]
+        result.extend(
+            DomainInfo(
+                domain=s.domain,
+                display_name=s.display_name or s.domain,
+                document_count=s.document_count,
+            )
+            for s in existing
+            if s.domain not in _INITIAL_IDS
+        )
         return result
     except Exception as e:
         logger.error(f"List domains error: {e}")
@@ -180,28 +384,32 @@ WELCOME_EN = {
     ],
 }
 
+# Static welcome payloads rendered once at import; only available_domains
+# varies per request
+_LANGUAGES = ["it", "en"] if ALLOW_ENGLISH else ["it"]
+_WELCOME_IT_BODY = {**WELCOME_IT, "languages": _LANGUAGES}
+_WELCOME_EN_BODY = {**WELCOME_EN, "languages": _LANGUAGES}
+
 
 @router.get("/welcome")
 async def get_welcome_message(lang: Optional[str] = Query(None, description="Language: it or en")):
     """Get a welcome message and 3 generic suggestions in the requested language."""
-    try:
-        store_manager = StoreManager()
-        stores = await store_manager.list_stores()
-        domain_names = [store.domain for store in stores]
-    except Exception:
-        domain_names = []
-
     lang = (lang or "it").strip().lower()
     if lang not in ("en", "it") or not ALLOW_ENGLISH:
         lang = "it"
-    content = WELCOME_EN if lang == "en" else WELCOME_IT
+    body = _WELCOME_EN_BODY if lang == "en" else _WELCOME_IT_BODY
 
-    return {
-        "message": content["message"],
-        "available_domains": domain_names,
-        "suggestions": content["suggestions"],
-        "languages": ["it", "en"] if ALLOW_ENGLISH else ["it"],
-    }
+    # The welcome text is static; don't block it behind a Gemini round-trip.
+    # Give the (usually warm) store-list cache 100 ms, else answer without
+    # domains — the shielded task keeps refreshing the cache in background.
+    fetch = asyncio.ensure_future(list_stores_cached())
+    try:
+        stores = await asyncio.wait_for(asyncio.shield(fetch), timeout=0.1)
+        domain_names = [store.domain for store in stores]
+    except TimeoutError:
+        domain_names = []
+
+    return {**body, "available_domains": domain_names}
 
 
 @router.get("/agent/status")
@@ -239,7 +447,7 @@ async def test_agent():
         return {
             "success": True,
             "response_length": len(result.get("response", "")),
-            "is_demo": "demo mode" in result.get("response", "").lower() or "⚠️" in result.get("response", ""),
+            "is_demo": _DEMO_RE.search(result.get("response", "")) is not None,
             "response_preview": result.get("response", "")[:200],
             "sources_count": len(result.get("sources", []))
         }
@@ -11,10 +11,44 @@ load_dotenv()
 # Gemini Configuration
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 MODEL = os.getenv("MODEL", "gemini-2.5-flash")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-004")
 
 # Store naming prefix - stores will be named: {STORE_PREFIX}-{domain}
 STORE_PREFIX = os.getenv("STORE_PREFIX", "ulss9")
 
+# Process-wide Gemini client (created lazily on first use)
+_genai_client = None
+
+
+def get_genai_client():
+    """
+    Return the shared Gemini client, creating it on first call.
+
+    A single client means one HTTPS connection pool for the whole process;
+    agent and store manager no longer pay TLS/DNS setup per instance.
+    Raises if GEMINI_API_KEY is not set or client construction fails.
+    """
+    global _genai_client
+    if _genai_client is None:
+        import httpx
+        from google import genai  # local import keeps config cheap to load
+        from google.genai import types
+
+        if not GEMINI_API_KEY:
+            raise ValueError("GEMINI_API_KEY not set")
+        # Size the httpx pool for our bounded fan-outs (uploads, counts,
+        # chat concurrency) so bursts reuse keep-alive connections instead
+        # of opening/closing sockets
+        limits = httpx.Limits(max_connections=32, max_keepalive_connections=16)
+        _genai_client = genai.Client(
+            api_key=GEMINI_API_KEY,
+            http_options=types.HttpOptions(
+                client_args={"limits": limits},
+                async_client_args={"limits": limits},
+            ),
+        )
+    return _genai_client
+
 # ULSS 9 initial store registry (Allegato A – quattro aree obbligatorie).
 # Altre categorie possono essere aggiunte via API (POST /api/admin/stores).
 ULSS9_STORES = [
@@ -36,6 +70,10 @@ ULSS9_STORES = [
     },
 ]
 
+# Max concurrent outgoing Gemini calls per process (queue in-process instead
+# of exhausting the client's connection pool under burst load)
+GEMINI_CONCURRENCY = int(os.getenv("GEMINI_CONCURRENCY", "64"))
+
 # Language: if True, frontend can offer English; chatbot will respond in chosen language
 ALLOW_ENGLISH = os.getenv("ALLOW_ENGLISH", "false").lower() == "true"
 
@@ -2,19 +2,30 @@
 UniVR Chatbot - Main FastAPI Application
 """
 
+import asyncio
 import logging
 from contextlib import asynccontextmanager
 from pathlib import Path
 
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 
 from app.api import admin, auth, chat
 from app.config import APP_ENV, DEBUG, GEMINI_API_KEY
 
+# uvloop (bundled with uvicorn[standard]) roughly doubles event-loop
+# throughput; install it before any loop is created so embedded runners
+# (tests, plain `python -m uvicorn`) get it too
+try:
+    import uvloop
+
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+except ImportError:
+    pass
+
 # Configure logging
 logging.basicConfig(
     level=logging.DEBUG if DEBUG else logging.INFO,
@@ -28,17 +39,37 @@ TEMPLATES_DIR = BASE_DIR / "templates"
 STATIC_DIR = BASE_DIR / "static"
 
 
+async def _warm_agent() -> None:
+    """
+    Pre-warm the shared Gemini client, store cache and StoreManager so the
+    first request does not pay client construction plus a full store list.
+    """
+    try:
+        from app.api.admin import get_store_manager
+
+        get_store_manager()
+        await chat.agent.prime_store_cache()
+        logger.info("🔥 Gemini client and store cache pre-warmed")
+    except Exception as e:
+        logger.warning(f"Startup warm-up failed (first request will pay it): {e}")
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan - startup and shutdown events."""
     logger.info(f"🚀 ULSS 9 Chatbot starting in {APP_ENV} mode")
-    
+
     # Log agent initialization status
     api_key_status = "✅ Set" if GEMINI_API_KEY else "❌ Not set"
     logger.info(f"📋 Configuration: API Key {api_key_status} (length: {len(GEMINI_API_KEY) if GEMINI_API_KEY else 0})")
     logger.info(f"🤖 Agent client initialized: {chat.agent.client is not None}")
-    
+
+    # Warm in the background so startup is not blocked on the network
+    warm_task = asyncio.create_task(_warm_agent()) if chat.agent.client else None
+
     yield
+    if warm_task:
+        warm_task.cancel()
     logger.info("👋 ULSS 9 Chatbot shutting down")
 
 
@@ -48,6 +79,9 @@ app = FastAPI(
     description="RAG-based assistant for Azienda ULSS 9 Scaligera (informazioni generali, orari, sedi, servizi, documenti)",
     version="0.2.0",
     lifespan=lifespan,
+    # orjson keeps JSON encoding in native code; matters for large
+    # sources/links arrays and long admin document lists
+    default_response_class=ORJSONResponse,
 )
 
 # CORS middleware
@@ -0,0 +1,48 @@
+"""
+ULSS 9 - In-flight request coalescing.
+
+Gemini's batch endpoint is asynchronous (results arrive minutes later), so
+true multi-prompt micro-batching cannot serve interactive chat. What does
+pay off under burst load is coalescing: concurrent identical requests
+share one in-flight Gemini call instead of fanning out N times. Bursts of
+the same message are common here because the UI offers the same three
+welcome suggestions to every user.
+"""
+
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable
+from typing import Hashable
+
+logger = logging.getLogger(__name__)
+
+
+class Coalescer:
+    """Deduplicate concurrent calls by key: followers await the leader's result."""
+
+    def __init__(self):
+        self._inflight: dict[Hashable, asyncio.Task] = {}
+
+    async def run(self, key: Hashable, coro_fn: Callable[[], Awaitable]):
+        """
+        Run coro_fn() at most once per key at a time; callers arriving while
+        it is in flight await the same result. The shared work runs in its
+        own task, so one caller being cancelled (a client disconnecting
+        mid-call) cannot cancel the call out from under the other waiters.
+        The entry is dropped on completion, so this coalesces concurrent
+        work only — it is not a cache.
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(coro_fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._on_done(key, t))
+        else:
+            logger.debug(f"Coalescing request onto in-flight call for key {key!r}")
+        # Shield: a cancelled waiter must not cancel the shared task
+        return await asyncio.shield(task)
+
+    def _on_done(self, key: Hashable, task: asyncio.Task) -> None:
+        self._inflight.pop(key, None)
+        if not task.cancelled():
+            task.exception()  # mark retrieved even if every waiter was cancelled
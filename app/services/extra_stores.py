@@ -4,58 +4,115 @@ Extra stores added via API – persist descriptions for store selection.
 Initial stores are the four from Allegato A (config.ULSS9_STORES).
 Stores created via POST /api/admin/stores are "extra"; their descriptions
 are saved here so the store selector can include them.
+
+Storage is a small SQLite table (data/descriptions.db): point reads and
+INSERT OR REPLACE writes are atomic, so concurrent admin requests can no
+longer lose each other's updates the way the old whole-file JSON
+read-modify-write could. A legacy store_descriptions.json file is migrated
+into the table once at import.
 """
 
-import json
 import logging
+import sqlite3
 from pathlib import Path
 
+import orjson
+
 from app.config import ULSS9_STORES
 
 logger = logging.getLogger(__name__)
 
-# Persist in data/store_descriptions.json
 BASE_DIR = Path(__file__).resolve().parent.parent.parent
-DESCRIPTIONS_FILE = BASE_DIR / "data" / "store_descriptions.json"
+DESCRIPTIONS_DB = BASE_DIR / "data" / "descriptions.db"
+# Legacy JSON location, read once for migration then left in place
+LEGACY_DESCRIPTIONS_FILE = BASE_DIR / "data" / "store_descriptions.json"
 
-INITIAL_IDS = {s["id"] for s in ULSS9_STORES}
+INITIAL_IDS = frozenset(s["id"] for s in ULSS9_STORES)
 
 
-def _load_descriptions() -> dict[str, str]:
-    """Load domain -> description for extra stores."""
-    if not DESCRIPTIONS_FILE.exists():
-        return {}
+def _connect() -> sqlite3.Connection:
+    DESCRIPTIONS_DB.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(DESCRIPTIONS_DB)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS descriptions(domain TEXT PRIMARY KEY, description TEXT)"
+    )
+    return conn
+
+
+def _migrate_legacy_json() -> None:
+    """One-time import of the old store_descriptions.json into SQLite."""
+    if not LEGACY_DESCRIPTIONS_FILE.exists():
+        return
     try:
-        data = json.loads(DESCRIPTIONS_FILE.read_text(encoding="utf-8"))
-        return data if isinstance(data, dict) else {}
+        data = orjson.loads(LEGACY_DESCRIPTIONS_FILE.read_bytes())
+        if not isinstance(data, dict):
+            return
+        conn = _connect()
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO descriptions(domain, description) VALUES (?, ?)",
+                    [(d, desc) for d, desc in data.items() if d not in INITIAL_IDS],
+                )
+        finally:
+            conn.close()
+        logger.info(f"Migrated {len(data)} store description(s) from legacy JSON")
     except Exception as e:
-        logger.warning(f"Could not load store_descriptions: {e}")
-        return {}
+        logger.warning(f"Could not migrate legacy store_descriptions.json: {e}")
 
 
-def _save_descriptions(descriptions: dict[str, str]) -> None:
-    """Save domain -> description for extra stores."""
-    DESCRIPTIONS_FILE.parent.mkdir(parents=True, exist_ok=True)
-    DESCRIPTIONS_FILE.write_text(
-        json.dumps(descriptions, ensure_ascii=False, indent=2),
-        encoding="utf-8",
-    )
+_migrate_legacy_json()
+
+
+def get_extra_descriptions() -> dict[str, str]:
+    """Return the full domain -> description mapping for extra stores."""
+    conn = _connect()
+    try:
+        return dict(conn.execute("SELECT domain, description FROM descriptions"))
+    except Exception as e:
+        logger.warning(f"Could not load store descriptions: {e}")
+        return {}
+    finally:
+        conn.close()
 
 
 def get_extra_description(domain: str) -> str | None:
     """Return saved description for a store added via API, or None."""
-    return _load_descriptions().get(domain)
+    conn = _connect()
+    try:
+        row = conn.execute(
+            "SELECT description FROM descriptions WHERE domain = ?", (domain,)
+        ).fetchone()
+        return row[0] if row else None
+    except Exception as e:
+        logger.warning(f"Could not load store description: {e}")
+        return None
+    finally:
+        conn.close()
 
 
 def set_extra_description(domain: str, description: str) -> None:
     """Save description for a store (used when creating store via API)."""
     if domain in INITIAL_IDS:
         return  # do not overwrite initial store descriptions
-    desc = _load_descriptions()
-    desc[domain] = description
-    _save_descriptions(desc)
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO descriptions(domain, description) VALUES (?, ?)",
+                (domain, description),
+            )
+    finally:
+        conn.close()
 
 
 def list_extra_store_ids() -> list[str]:
     """Return domain ids that have a saved description (extra stores)."""
-    return list(_load_descriptions().keys())
+    conn = _connect()
+    try:
+        return [row[0] for row in conn.execute("SELECT domain FROM descriptions")]
+    except Exception as e:
+        logger.warning(f"Could not list store descriptions: {e}")
+        return []
+    finally:
+        conn.close()
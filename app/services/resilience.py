@@ -0,0 +1,91 @@
+"""
+ULSS 9 - Retry and circuit-breaker helpers for Gemini calls.
+
+Transient 429/5xx responses used to be swallowed by broad except blocks,
+so a throttled API still cost one failed round-trip per call (RAG,
+selection and follow-up alike). Retry those specific codes with
+exponential backoff, and trip a shared breaker after repeated failures so
+the process backs off entirely for a cooldown instead of slamming an API
+that is down.
+"""
+
+import asyncio
+import logging
+import random
+import time
+from collections.abc import Awaitable, Callable
+
+from google.genai import errors
+
+logger = logging.getLogger(__name__)
+
+# Throttling and server-side errors worth retrying; 4xx request errors are not
+_RETRYABLE_CODES = frozenset({429, 500, 502, 503, 504})
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """True for Gemini throttling/server errors (429/5xx)."""
+    return isinstance(exc, errors.APIError) and exc.code in _RETRYABLE_CODES
+
+
+async def with_retry(fn: Callable[[], Awaitable], retries: int = 3, base: float = 0.1):
+    """
+    Await fn(), retrying only 429/5xx APIErrors with exponential backoff
+    plus jitter. Any other exception propagates immediately so real bugs
+    still surface.
+    """
+    for attempt in range(retries):
+        try:
+            return await fn()
+        except errors.APIError as e:
+            if e.code not in _RETRYABLE_CODES or attempt == retries - 1:
+                raise
+            delay = base * (2 ** attempt) * (1.0 + random.random())
+            logger.warning(
+                f"Gemini returned {e.code}, retrying in {delay:.2f}s "
+                f"(attempt {attempt + 1}/{retries})"
+            )
+            await asyncio.sleep(delay)
+
+
+class CircuitBreaker:
+    """
+    Trip after fail_threshold consecutive retryable failures; while open,
+    is_open() is True for cooldown seconds so callers can short-circuit to
+    their fallback without paying a doomed round-trip. After the cooldown
+    the next call probes the API again (half-open).
+    """
+
+    def __init__(self, fail_threshold: int = 5, cooldown: float = 30.0):
+        self.fail_threshold = fail_threshold
+        self.cooldown = cooldown
+        self._failures = 0
+        self._opened_at: float | None = None
+
+    def is_open(self) -> bool:
+        if self._opened_at is None:
+            return False
+        if time.monotonic() - self._opened_at >= self.cooldown:
+            # Half-open: let one caller probe; a failure re-opens immediately
+            self._opened_at = None
+            self._failures = self.fail_threshold - 1
+            return False
+        return True
+
+    def record_success(self) -> None:
+        self._failures = 0
+        self._opened_at = None
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        if self._failures >= self.fail_threshold and self._opened_at is None:
+            logger.error(
+                f"Gemini circuit opened after {self._failures} consecutive failures; "
+                f"backing off for {self.cooldown:.0f}s"
+            )
+            self._opened_at = time.monotonic()
+
+
+# One breaker for the process: every Gemini caller shares the same view of
+# the API's health
+gemini_breaker = CircuitBreaker()
@@ -0,0 +1,174 @@
+"""
+ULSS 9 - Approximate semantic cache for chat responses.
+
+Chatbot traffic repeats itself: many users ask near-identical questions
+(often the welcome suggestions verbatim). Cache the assembled chat payload
+keyed by the Gemini embedding of the message; a new message whose embedding
+is within cosine similarity tau of a cached one reuses that payload and
+skips store selection, RAG and follow-up generation entirely.
+"""
+
+import asyncio
+import logging
+
+import numpy as np
+
+from app.config import EMBEDDING_MODEL
+from app.services.resilience import gemini_breaker, is_retryable, with_retry
+
+logger = logging.getLogger(__name__)
+
+
+async def embed_query(client, text: str) -> np.ndarray | None:
+    """
+    Embed text with Gemini and L2-normalize it.
+    Returns None on any failure so callers can fall through to the full flow.
+    """
+    if gemini_breaker.is_open():
+        return None
+    try:
+        response = await with_retry(
+            lambda: asyncio.to_thread(
+                lambda: client.models.embed_content(model=EMBEDDING_MODEL, contents=text)
+            ),
+            retries=2,
+        )
+        gemini_breaker.record_success()
+        vec = np.asarray(response.embeddings[0].values, dtype=np.float32)
+        norm = float(np.linalg.norm(vec))
+        if norm == 0.0:
+            return None
+        return vec / norm
+    except Exception as e:
+        if is_retryable(e):
+            gemini_breaker.record_failure()
+        logger.warning(f"Query embedding failed: {e}")
+        return None
+
+
+class LSHIndex:
+    """
+    Random-projection LSH over L2-normalized embeddings.
+
+    Each of num_tables tables hashes a vector to a bits-bit signature from
+    the signs of Gaussian projections; similar vectors collide in at least
+    one table with high probability. Lookup gathers candidate row indices
+    from the matching bucket of every table, so the exact cosine check runs
+    over a short candidate list instead of the whole key matrix.
+    """
+
+    def __init__(self, num_tables: int = 8, bits: int = 16, seed: int = 0):
+        self.num_tables = num_tables
+        self.bits = bits
+        self._rng = np.random.default_rng(seed)
+        self._planes: np.ndarray | None = None  # (num_tables, bits, d), lazy
+        self._buckets: list[dict[int, list[int]]] = [{} for _ in range(num_tables)]
+        self._sigs: dict[int, list[int]] = {}  # row idx -> its signatures
+        self._weights = (1 << np.arange(bits)).astype(np.int64)
+
+    def _signatures(self, q: np.ndarray) -> list[int]:
+        if self._planes is None:
+            self._planes = self._rng.standard_normal(
+                (self.num_tables, self.bits, q.shape[0])
+            ).astype(np.float32)
+        projections = self._planes @ q  # (num_tables, bits)
+        return [int(s) for s in (projections > 0).astype(np.int64) @ self._weights]
+
+    def add(self, q: np.ndarray, idx: int) -> None:
+        """Register row idx under q's signature in every table."""
+        self.remove(idx)
+        sigs = self._signatures(q)
+        for table, sig in zip(self._buckets, sigs):
+            table.setdefault(sig, []).append(idx)
+        self._sigs[idx] = sigs
+
+    def remove(self, idx: int) -> None:
+        """Drop row idx (no-op if unknown); used when a cache slot is reused."""
+        sigs = self._sigs.pop(idx, None)
+        if sigs is None:
+            return
+        for table, sig in zip(self._buckets, sigs):
+            bucket = table.get(sig)
+            if bucket and idx in bucket:
+                bucket.remove(idx)
+
+    def candidates(self, q: np.ndarray) -> list[int]:
+        """Candidate row indices colliding with q in any table."""
+        if self._planes is None:
+            return []
+        out: set[int] = set()
+        for table, sig in zip(self._buckets, self._signatures(q)):
+            out.update(table.get(sig, ()))
+        return list(out)
+
+    def clear(self) -> None:
+        self._buckets = [{} for _ in range(self.num_tables)]
+        self._sigs = {}
+
+
+class ProximityCache:
+    """
+    Fixed-capacity approximate KV cache over L2-normalized embeddings.
+
+    Keys live in a preallocated int8 matrix with a per-row scale (4× less
+    memory and lookup bandwidth than float32; at tau >= 0.92 the rounding
+    error is far below the match threshold). An LSH index shortlists
+    candidate rows so the exact cosine check — done on the dequantized
+    shortlist — is O(candidates), not O(N), as the cache fills. Eviction
+    is LRU. Callers embed the query once and pass the normalized vector in.
+    """
+
+    def __init__(self, tau: float = 0.92, capacity: int = 512):
+        self.tau = tau
+        self.capacity = capacity
+        self._keys: np.ndarray | None = None  # int8, allocated on first add
+        self._scales = np.zeros(capacity, dtype=np.float32)  # per-row dequant factor
+        self._values: list[dict | None] = [None] * capacity
+        self._last_used = np.zeros(capacity, dtype=np.float64)
+        self._n = 0
+        self._clock = 0.0
+        self._index = LSHIndex()
+
+    def _tick(self) -> float:
+        self._clock += 1.0
+        return self._clock
+
+    def lookup(self, q: np.ndarray) -> dict | None:
+        """Return the cached payload most similar to q if it clears tau."""
+        if self._n == 0 or self._keys is None:
+            return None
+        candidates = self._index.candidates(q)
+        if not candidates:
+            return None
+        rows = np.asarray(candidates, dtype=np.intp)
+        # Dequantize only the shortlist: candidate lists are a handful of rows
+        keys = self._keys[rows].astype(np.float32) * self._scales[rows, None]
+        sims = keys @ q
+        best = int(np.argmax(sims))
+        if float(sims[best]) >= self.tau:
+            idx = int(rows[best])
+            self._last_used[idx] = self._tick()
+            return self._values[idx]
+        return None
+
+    def add(self, q: np.ndarray, payload: dict) -> None:
+        """Insert (q, payload), evicting the least recently used entry if full."""
+        if self._keys is None:
+            self._keys = np.zeros((self.capacity, q.shape[0]), dtype=np.int8)
+        if self._n < self.capacity:
+            idx = self._n
+            self._n += 1
+        else:
+            idx = int(np.argmin(self._last_used[: self._n]))
+        scale = float(np.abs(q).max()) / 127.0 or 1.0
+        self._keys[idx] = np.round(q / scale).astype(np.int8)
+        self._scales[idx] = scale
+        self._values[idx] = payload
+        self._last_used[idx] = self._tick()
+        self._index.add(q, idx)
+
+    def clear(self) -> None:
+        """Drop all entries (e.g. after the store registry changes)."""
+        self._n = 0
+        self._values = [None] * self.capacity
+        self._index.clear()
@@ -5,20 +5,30 @@ Handles creation, management, and document uploads for Gemini File Search Stores
 Each store represents a RAG domain (e.g., scholarships, admissions).
 """
 
+import asyncio
 import logging
+import os
 import time
 import uuid
 from pathlib import Path
 from typing import Optional
 
-from google import genai
 from google.genai import types
 from pydantic import BaseModel
 
-from app.config import GEMINI_API_KEY, MODEL, STORE_PREFIX
+from app.config import GEMINI_API_KEY, MODEL, STORE_PREFIX, get_genai_client
+from app.services.resilience import with_retry
 
 logger = logging.getLogger(__name__)
 
+# Upload/indexing poll knobs: fast first checks so small files finish
+# quickly, decaying towards a gentle steady-state so long indexing jobs
+# don't burn round-trips and quota (operations.get is the only wait the
+# SDK offers — there is no server-side long-poll)
+_POLL_INITIAL = float(os.getenv("INGEST_POLL_INITIAL", "0.5"))
+_POLL_FACTOR = float(os.getenv("INGEST_POLL_FACTOR", "2.0"))
+_POLL_CAP = float(os.getenv("INGEST_POLL_CAP", "15.0"))
+
 
 class DocumentMetadata(BaseModel):
     """Metadata extracted from a document."""
@@ -41,16 +51,57 @@ class StoreManager:
     Each store represents a RAG domain.
     """
     
-    def __init__(self):
-        """Initialize the store manager."""
-        self.client = None
-        if GEMINI_API_KEY:
+    def __init__(self, client=None):
+        """
+        Initialize the store manager.
+
+        Args:
+            client: An existing Gemini client to reuse (e.g. the agent's).
+                Defaults to the process-wide shared client, so every manager
+                rides the same warm HTTPS connection pool.
+        """
+        self.client = client
+        if self.client is None and GEMINI_API_KEY:
             try:
-                self.client = genai.Client(api_key=GEMINI_API_KEY)
+                self.client = get_genai_client()
                 logger.debug("StoreManager: Gemini client initialized")
             except Exception as e:
                 logger.error(f"StoreManager: Failed to initialize Gemini client: {e}", exc_info=True)
+        # Short-TTL caches: one list RPC refreshes every store, and document
+        # lists are reused between duplicate checks and count queries.
+        # Bulk ingest otherwise pays >= 3 list round-trips per upload.
+        self._cache_ttl = 30.0
+        self._store_cache: dict[str, types.FileSearchStore] = {}
+        self._store_cache_at = float("-inf")
+        self._docs_cache: dict[str, tuple[float, list]] = {}
+        # store.name -> file_name -> [doc resource names]; lets duplicate
+        # replacement resolve doc names with a point lookup instead of
+        # rescanning every document's metadata on each upload
+        self._name_index: dict[str, dict[str, list[str]]] = {}
     
+    async def _run(self, fn, /, *args, **kwargs):
+        """
+        Run a blocking SDK call in a worker thread so the event loop keeps
+        serving chat requests while admin/upload operations are in flight.
+        Pass a lambda that materializes the result for generator-returning
+        calls, so iteration happens off-loop too.
+        """
+        return await asyncio.to_thread(fn, *args, **kwargs)
+
+    async def _wait_until(self, obj, is_done, refresh):
+        """
+        Poll `refresh(obj)` (a blocking SDK call, run off-loop with retries)
+        until `is_done(obj)`, sleeping _POLL_INITIAL seconds first and
+        multiplying by _POLL_FACTOR up to _POLL_CAP between polls. The knobs
+        come from INGEST_POLL_INITIAL/FACTOR/CAP.
+        """
+        delay = _POLL_INITIAL
+        while not is_done(obj):
+            await asyncio.sleep(delay)
+            delay = min(delay * _POLL_FACTOR, _POLL_CAP)
+            obj = await with_retry(lambda: self._run(refresh, obj))
+        return obj
+
     def _get_store_display_name(self, domain: str) -> str:
         """Generate store display name from domain."""
         return f"{STORE_PREFIX}-{domain}"
@@ -62,16 +113,61 @@ class StoreManager:
             return display_name[len(prefix):]
         return None
     
+    def _refresh_store_cache(self) -> None:
+        """Reload display_name -> store for every store with one list call."""
+        cache: dict[str, types.FileSearchStore] = {}
+        for store in self.client.file_search_stores.list():
+            if store.display_name:
+                cache[store.display_name] = store
+        self._store_cache = cache
+        self._store_cache_at = time.monotonic()
+
+    def _list_documents_raw(self, store_name: str) -> list:
+        """Documents of a store, cached per store name for _cache_ttl seconds."""
+        entry = self._docs_cache.get(store_name)
+        if entry and time.monotonic() - entry[0] < self._cache_ttl:
+            return entry[1]
+        docs = list(self.client.file_search_stores.documents.list(parent=store_name))
+        self._docs_cache[store_name] = (time.monotonic(), docs)
+        self._name_index[store_name] = self._build_name_index(docs)
+        return docs
+
+    @staticmethod
+    def _build_name_index(docs: list) -> dict[str, list[str]]:
+        """Map display_name / custom file_name to doc resource names."""
+        index: dict[str, list[str]] = {}
+        for doc in docs:
+            keys = set()
+            if doc.display_name:
+                keys.add(doc.display_name)
+            if doc.custom_metadata:
+                for meta in doc.custom_metadata:
+                    if meta.key == "file_name" and meta.string_value:
+                        keys.add(meta.string_value)
+            for key in keys:
+                index.setdefault(key, []).append(doc.name)
+        return index
+
+    def _invalidate_documents(self, store_name: str) -> None:
+        """Drop the cached document list after an upload or delete."""
+        self._docs_cache.pop(store_name, None)
+        self._name_index.pop(store_name, None)
+
     def get_store(self, domain: str) -> types.FileSearchStore | None:
-        """Retrieve a store by domain name."""
+        """Retrieve a store by domain name (cached; one list RPC per TTL window)."""
         if not self.client:
             return None
-        
+
         display_name = self._get_store_display_name(domain)
         try:
-            for store in self.client.file_search_stores.list():
-                if store.display_name == display_name:
-                    return store
+            if time.monotonic() - self._store_cache_at >= self._cache_ttl:
+                self._refresh_store_cache()
+            store = self._store_cache.get(display_name)
+            if store is None:
+                # Miss may mean the store was just created elsewhere: re-list once
+                self._refresh_store_cache()
+                store = self._store_cache.get(display_name)
+            return store
         except Exception as e:
             logger.error(f"Error finding store: {e}")
         return None
@@ -93,62 +189,86 @@ class StoreManager:
         display_name = self._get_store_display_name(domain)
         
         # Check if store already exists
-        existing = self.get_store(domain)
+        existing = await self._run(self.get_store, domain)
         if existing:
             logger.info(f"Store '{display_name}' already exists")
             return existing
-        
+
         # Create new store
-        store = self.client.file_search_stores.create(
-            config={"display_name": display_name}
+        store = await self._run(
+            self.client.file_search_stores.create,
+            config={"display_name": display_name},
         )
+        self._store_cache[display_name] = store
         logger.info(f"Created new store: {store.name} for domain '{domain}'")
         return store
     
-    async def list_stores(self) -> list[StoreInfo]:
-        """List all domain stores."""
+    async def list_stores(self, include_counts: bool = False) -> list[StoreInfo]:
+        """
+        List all domain stores.
+
+        Document counts cost one documents.list per store (the SDK exposes no
+        server-side count), so callers that only need names/domains can pass
+        include_counts=False and skip that traffic; counts then stay 0.
+        """
         if not self.client:
             return []
-        
-        stores = []
-        prefix = f"{STORE_PREFIX}-"
-        
+
         try:
-            for store in self.client.file_search_stores.list():
-                # Only include stores with our prefix
-                if store.display_name and store.display_name.startswith(prefix):
-                    domain = self._extract_domain_from_display_name(store.display_name)
-                    
-                    # Count documents
-                    doc_count = 0
-                    try:
-                        docs = list(self.client.file_search_stores.documents.list(parent=store.name))
-                        doc_count = len(docs)
-                    except Exception:
-                        pass
-                    
-                    stores.append(StoreInfo(
-                        name=store.name,
-                        display_name=store.display_name,
-                        domain=domain or "",
-                        document_count=doc_count
-                    ))
+            raw = await self._run(lambda: list(self.client.file_search_stores.list()))
         except Exception as e:
             logger.error(f"Error listing stores: {e}")
-        
-        return stores
+            return []
+
+        # One list RPC already names every store: refresh the store cache too
+        self._store_cache = {s.display_name: s for s in raw if s.display_name}
+        self._store_cache_at = time.monotonic()
+
+        # Only include stores with our prefix
+        prefix = f"{STORE_PREFIX}-"
+        filtered = [s for s in raw if s.display_name and s.display_name.startswith(prefix)]
+
+        if include_counts:
+            # Count documents for all stores in parallel (bounded), not one RTT each
+            sem = asyncio.Semaphore(8)
+
+            async def _count(store_name: str) -> int:
+                async with sem:
+                    try:
+                        return len(await self._run(self._list_documents_raw, store_name))
+                    except Exception:
+                        return 0
+
+            counts = await asyncio.gather(*(_count(s.name) for s in filtered))
+        else:
+            counts = [0] * len(filtered)
+        # Inputs come straight from the SDK and the count helper, so skip
+        # pydantic validation (model_construct) when building the rows
+        return [
+            StoreInfo.model_construct(
+                name=store.name,
+                display_name=store.display_name,
+                domain=self._extract_domain_from_display_name(store.display_name) or "",
+                document_count=count,
+            )
+            for store, count in zip(filtered, counts)
+        ]
     
     async def delete_store(self, domain: str) -> bool:
         """Delete a store by domain."""
         if not self.client:
             return False
         
-        store = self.get_store(domain)
+        store = await self._run(self.get_store, domain)
         if not store:
             return False
-        
+
         try:
-            self.client.file_search_stores.delete(name=store.name, config={"force": True})
+            await self._run(
+                self.client.file_search_stores.delete, name=store.name, config={"force": True}
+            )
+            self._store_cache.pop(self._get_store_display_name(domain), None)
+            self._invalidate_documents(store.name)
             logger.info(f"Deleted store for domain '{domain}'")
             return True
         except Exception as e:
@@ -183,7 +303,7 @@ class StoreManager:
         if not self.client:
             raise ValueError("Gemini client not initialized. Check API key.")
 
-        store = self.get_store(domain)
+        store = await self._run(self.get_store, domain)
         if not store:
             raise ValueError(f"Store for domain '{domain}' not found. Create it first.")
 
@@ -193,23 +313,33 @@ class StoreManager:
 
         # Upload file temporarily for metadata extraction
         logger.info(f"Uploading {file_name} for processing...")
-        temp_file = self.client.files.upload(file=file_path)
+        # Name the File now: import_file carries no display_name, so this is
+        # what store documents end up showing in the admin listing
+        temp_file = await self._run(
+            self.client.files.upload,
+            file=file_path,
+            config={"display_name": file_name},
+        )
 
-        # Wait for file to be ready
-        while temp_file.state.name == "PROCESSING":
-            time.sleep(2)
-            temp_file = self.client.files.get(name=temp_file.name)
+        # Wait for file to be ready: adaptive backoff, concurrent uploads
+        # overlap instead of serializing on the event loop
+        temp_file = await self._wait_until(
+            temp_file,
+            lambda f: f.state.name != "PROCESSING",
+            lambda f: self.client.files.get(name=f.name),
+        )
 
         if temp_file.state.name != "ACTIVE":
             raise RuntimeError(f"File upload failed with state: {temp_file.state.name}")
 
-        # Extract metadata using Gemini
-        metadata = await self._extract_metadata(temp_file, domain)
+        # Metadata extraction (Gemini) and duplicate removal are independent;
+        # overlap them so the upload pays max() of the two, not the sum
+        metadata, _ = await asyncio.gather(
+            self._extract_metadata(temp_file, domain),
+            self._delete_existing(store, file_name),
+        )
         title = title_override or metadata.title
 
-        # Check for and delete existing version (replace duplicate)
-        await self._delete_existing(store, file_name)
-
         # Build custom_metadata: base + source_type and optional url/document_id
         custom_metadata = [
             {"key": "title", "string_value": title},
@@ -223,21 +353,25 @@ class StoreManager:
         if document_id:
             custom_metadata.append({"key": "document_id", "string_value": document_id})
 
-        # Import to File Search Store with metadata
-        operation = self.client.file_search_stores.upload_to_file_search_store(
+        # Import the file already uploaded for metadata extraction instead of
+        # retransmitting the bytes with upload_to_file_search_store. Note
+        # ImportFileConfig has no display_name; the title (and file_name used
+        # for duplicate replacement) live in custom_metadata either way.
+        operation = await self._run(
+            self.client.file_search_stores.import_file,
             file_search_store_name=store.name,
-            file=file_path,
-            config={
-                "display_name": title,
-                "custom_metadata": custom_metadata,
-            },
+            file_name=temp_file.name,
+            config={"custom_metadata": custom_metadata},
         )
 
-        # Wait for indexing to complete
-        while not operation.done:
-            time.sleep(3)
-            operation = self.client.operations.get(operation)
+        # Wait for indexing to complete, backing off between polls
+        operation = await self._wait_until(
+            operation,
+            lambda op: op.done,
+            lambda op: self.client.operations.get(op),
+        )
 
+        self._invalidate_documents(store.name)
         logger.info(f"Document '{file_name}' uploaded and indexed to domain '{domain}' (source_type={source_type})")
 
         result = {
@@ -257,7 +391,8 @@ class StoreManager:
         """Extract metadata from a document using Gemini."""
         logger.info("Extracting metadata...")
         
-        response = self.client.models.generate_content(
+        response = await self._run(
+            self.client.models.generate_content,
             model=MODEL,
             contents=[
                 f"""Extract the following from this document:
@@ -281,49 +416,65 @@ class StoreManager:
         return metadata
     
     async def _delete_existing(self, store, file_name: str):
-        """Delete existing document with the same name (replace duplicate)."""
-        try:
-            for doc in self.client.file_search_stores.documents.list(parent=store.name):
-                should_delete = False
-                
-                if doc.display_name == file_name:
-                    should_delete = True
-                elif doc.custom_metadata:
-                    for meta in doc.custom_metadata:
-                        if meta.key == "file_name" and meta.string_value == file_name:
-                            should_delete = True
-                            break
-                
-                if should_delete:
-                    logger.info(f"Replacing existing document: {doc.display_name}")
-                    self.client.file_search_stores.documents.delete(
-                        name=doc.name, 
-                        config={"force": True}
-                    )
-                    time.sleep(2)
-        except Exception as e:
-            logger.warning(f"Error checking for existing docs: {e}")
+        """Delete existing documents with the same name (replace duplicates)."""
+        # documents.list offers no server-side filter, so duplicates are
+        # resolved through the local name index: one list per TTL window,
+        # then O(1) lookups per upload
+        index = self._name_index.get(store.name)
+        if index is None:
+            try:
+                await self._run(self._list_documents_raw, store.name)
+            except Exception as e:
+                logger.warning(f"Error checking for existing docs: {e}")
+                return
+            index = self._name_index.get(store.name, {})
+        to_delete = index.get(file_name, [])
+        if not to_delete:
+            return
+
+        # Delete all duplicates concurrently (bounded); the upload that follows
+        # already waits for the store to finish processing, so no settle sleep
+        sem = asyncio.Semaphore(4)
+
+        async def _delete_one(doc_name: str) -> None:
+            async with sem:
+                logger.info(f"Replacing existing document: {doc_name} ({file_name})")
+                await self._run(
+                    self.client.file_search_stores.documents.delete,
+                    name=doc_name,
+                    config={"force": True},
+                )
+
+        results = await asyncio.gather(
+            *(_delete_one(name) for name in to_delete), return_exceptions=True
+        )
+        for doc_name, result in zip(to_delete, results):
+            if isinstance(result, BaseException):
+                logger.warning(f"Failed to delete existing doc {doc_name}: {result}")
+        self._invalidate_documents(store.name)
     
     async def list_documents(self, domain: str) -> list[dict]:
         """List all documents in a domain's store."""
         if not self.client:
             return []
         
-        store = self.get_store(domain)
+        store = await self._run(self.get_store, domain)
         if not store:
             return []
-        
+
         documents = []
         try:
-            for doc in self.client.file_search_stores.documents.list(parent=store.name):
+            for doc in await self._run(self._list_documents_raw, store.name):
                 metadata = {}
                 if doc.custom_metadata:
                     for meta in doc.custom_metadata:
                         metadata[meta.key] = meta.string_value
-                
+
                 documents.append({
                     "name": doc.name,
-                    "display_name": doc.display_name,
+                    # Imported documents may carry no display_name of their
+                    # own; fall back to the metadata the upload always sets
+                    "display_name": doc.display_name or metadata.get("title") or metadata.get("file_name", ""),
                     "metadata": metadata
                 })
         except Exception as e:
@@ -335,18 +486,56 @@ class StoreManager:
         """Delete a document from a domain's store."""
         if not self.client:
             return False
-        
-        store = self.get_store(domain)
+
+        store = await self._run(self.get_store, domain)
         if not store:
             return False
-        
+
         try:
-            self.client.file_search_stores.documents.delete(
+            await self._run(
+                self.client.file_search_stores.documents.delete,
                 name=doc_name,
-                config={"force": True}
+                config={"force": True},
             )
+            self._invalidate_documents(store.name)
             logger.info(f"Deleted document: {doc_name}")
             return True
         except Exception as e:
             logger.error(f"Error deleting document: {e}")
             return False
+
+
+# ============ Shared store-list cache ============
+#
+# /api/chat, /api/domains and /api/welcome all need the store list, which
+# rarely changes between requests; cache it for a short TTL so the common
+# path skips the file_search_stores.list round-trip.
+
+_shared_manager: StoreManager | None = None
+_store_list_cache: list[StoreInfo] = []
+_store_list_fetched_at: float = float("-inf")
+_store_list_lock = asyncio.Lock()
+
+
+async def list_stores_cached(ttl: float = 30.0) -> list[StoreInfo]:
+    """Return the store list, refreshed at most once per ttl seconds."""
+    global _shared_manager, _store_list_cache, _store_list_fetched_at
+    if time.monotonic() - _store_list_fetched_at < ttl:
+        return _store_list_cache
+    async with _store_list_lock:
+        # Another request may have refreshed while we waited for the lock
+        if time.monotonic() - _store_list_fetched_at < ttl:
+            return _store_list_cache
+        if _shared_manager is None:
+            _shared_manager = StoreManager()
+        # /api/domains and the welcome payload surface counts, so the shared
+        # cached list keeps them; the TTL amortises the extra RPCs anyway
+        _store_list_cache = await _shared_manager.list_stores(include_counts=True)
+        _store_list_fetched_at = time.monotonic()
+        return _store_list_cache
+
+
+def invalidate_store_list_cache() -> None:
+    """Force the next list_stores_cached call to refetch (after store/document mutations)."""
+    global _store_list_fetched_at
+    _store_list_fetched_at = float("-inf")
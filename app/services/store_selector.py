@@ -8,15 +8,71 @@ plus any extra stores added via API.
 
 import asyncio
 import logging
+import re
+import time
+from collections import OrderedDict
+from collections.abc import Sequence, Set as AbstractSet
+from functools import lru_cache
 from typing import Any
 
+import numpy as np
 from google.genai import types
 from pydantic import BaseModel
 
 from app.config import GEMINI_API_KEY, MODEL, ULSS9_STORES
+from app.services.batcher import Coalescer
+from app.services.resilience import gemini_breaker, is_retryable, with_retry
 
 logger = logging.getLogger(__name__)
 
+# Lexical preselection: most messages can be routed by keyword overlap with
+# the short store descriptions, so Gemini is consulted only when the lexical
+# scores are ambiguous (top-2 too close) or there is no overlap at all.
+_TOKEN_RE = re.compile(r"[a-zà-öø-ÿ0-9]+")
+# Function words that would otherwise dominate the tiny description corpus
+_STOPWORDS = frozenset(
+    "di a da in con su per tra fra il lo la i gli le un una uno e o che chi come dove "
+    "quando quali quale sono del della dei delle dello al alla ai alle allo si mi ci "
+    "non cosa è sul sulla presso relative relativi informazioni "
+    "the of an is are what where when how to for and at on".split()
+)
+_TIE_EPSILON = 0.15  # top-2 scores within 15% of each other = ambiguous
+_SELECT_RATIO = 0.6  # runner-up joins the selection at >= 60% of the top score
+_MIN_SCORE = 0.2  # cosine floor: weaker evidence defers to Gemini
+_MIN_MATCHED_TOKENS = 2  # single-token overlap is not enough to route locally
+
+# Fitted TF-IDF model (store ids, vocabulary, row-normalized description
+# matrix), keyed by the (id, description) tuples it was built from so any
+# change to the store registry refits automatically
+_lexical_model: tuple[tuple, list[str], dict[str, int], np.ndarray] | None = None
+
+
+# Gemini-backed selections, cached briefly and coalesced: repeated or
+# concurrent identical questions (the UI suggests the same prompts to every
+# user) should cost one classification RPC, not one per request
+_SELECTION_TTL = 60.0
+_SELECTION_CACHE_MAX = 512
+_selection_cache: OrderedDict[tuple, tuple[float, list[str]]] = OrderedDict()
+_selection_coalescer = Coalescer()
+
+
+def _selection_cache_get(key: tuple) -> list[str] | None:
+    entry = _selection_cache.get(key)
+    if entry is None:
+        return None
+    if time.monotonic() - entry[0] >= _SELECTION_TTL:
+        _selection_cache.pop(key, None)
+        return None
+    _selection_cache.move_to_end(key)
+    return list(entry[1])
+
+
+def _selection_cache_put(key: tuple, stores: list[str]) -> None:
+    _selection_cache[key] = (time.monotonic(), list(stores))
+    _selection_cache.move_to_end(key)
+    while len(_selection_cache) > _SELECTION_CACHE_MAX:
+        _selection_cache.popitem(last=False)
+
 
 class StoreSelectionOutput(BaseModel):
     """Structured output from Gemini for store selection."""
@@ -24,18 +80,137 @@ class StoreSelectionOutput(BaseModel):
     reason: str = ""
 
 
-def _build_store_list(extra_stores: list[dict] | None = None) -> tuple[list[dict], set[str]]:
+# Built once: constructing GenerateContentConfig derives the JSON schema
+# from the pydantic model, which is not worth repeating per request
+_SELECTION_CONFIG = types.GenerateContentConfig(
+    response_mime_type="application/json",
+    response_schema=StoreSelectionOutput,
+    temperature=0.2,
+)
+
+# The initial registry never changes at runtime; precompute its lookup
+# structures once instead of rebuilding them on every chat request
+_BASE_LIST: tuple[dict, ...] = tuple(ULSS9_STORES)
+_BASE_IDS: frozenset[str] = frozenset(s["id"] for s in ULSS9_STORES)
+
+
+def _build_store_list(
+    extra_stores: list[dict] | None = None,
+) -> tuple[Sequence[dict], AbstractSet[str]]:
     """Build full list of stores (initial + extra) and set of valid ids."""
-    full_list = list(ULSS9_STORES)
-    valid_ids = {s["id"] for s in ULSS9_STORES}
-    if extra_stores:
-        for s in extra_stores:
-            sid = s.get("id") or s.get("domain")
-            desc = s.get("description") or s.get("display_name", "")
-            if sid and sid not in valid_ids:
-                full_list.append({"id": sid, "description": desc})
-                valid_ids.add(sid)
-    return full_list, valid_ids
+    if not extra_stores:
+        # Common case: no extras — hand out the shared immutable structures
+        return _BASE_LIST, _BASE_IDS
+    full_list = list(_BASE_LIST)
+    valid_ids = set(_BASE_IDS)
+    for s in extra_stores:
+        sid = s.get("id") or s.get("domain")
+        desc = s.get("description") or s.get("display_name", "")
+        if sid and sid not in valid_ids:
+            full_list.append({"id": sid, "description": desc})
+            valid_ids.add(sid)
+    return full_list, frozenset(valid_ids)
+
+
+@lru_cache(maxsize=16)
+def _render_store_list(items: tuple[tuple[str, str], ...]) -> str:
+    """Render the prompt's store catalogue; invariant until the registry changes."""
+    return "\n".join(f"- {sid}: {desc}" for sid, desc in items)
+
+
+def _stem(token: str) -> str:
+    """
+    Very light Italian-aware stem: fold hard-c/g plurals (visite mediche /
+    visita medica) and trailing vowels so singular and plural forms of the
+    description terms land on the same vocabulary column.
+    """
+    if token.endswith(("che", "chi", "ghe", "ghi")):
+        token = token[:-2]
+    while len(token) > 3 and token[-1] in "aeiou":
+        token = token[:-1]
+    return token
+
+
+def _tokenize(text: str) -> list[str]:
+    return [
+        _stem(t)
+        for t in _TOKEN_RE.findall(text.lower())
+        if len(t) > 2 and t not in _STOPWORDS
+    ]
+
+
+def _fit_lexical_model(full_list: Sequence[dict]) -> tuple[list[str], dict[str, int], np.ndarray]:
+    """
+    TF-IDF matrix for the store descriptions (cached until they change).
+    Returns (store ids, token -> column, L2-row-normalized float32 matrix).
+    """
+    global _lexical_model
+    key = tuple((s["id"], s["description"]) for s in full_list)
+    if _lexical_model is not None and _lexical_model[0] == key:
+        return _lexical_model[1], _lexical_model[2], _lexical_model[3]
+
+    docs = [(s["id"], _tokenize(f"{s['id']} {s['description']}")) for s in full_list]
+    vocab: dict[str, int] = {}
+    for _, tokens in docs:
+        for tok in tokens:
+            if tok not in vocab:
+                vocab[tok] = len(vocab)
+
+    n = len(docs)
+    df = np.zeros(len(vocab), dtype=np.float32)
+    counts = np.zeros((n, len(vocab)), dtype=np.float32)
+    for row, (_, tokens) in enumerate(docs):
+        for tok in set(tokens):
+            df[vocab[tok]] += 1.0
+        for tok in tokens:
+            counts[row, vocab[tok]] += 1.0
+
+    idf = np.log((n + 1) / (df + 1)) + 1.0
+    matrix = counts * idf
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0.0] = 1.0
+    matrix /= norms
+
+    ids = [sid for sid, _ in docs]
+    _lexical_model = (key, ids, vocab, matrix)
+    return ids, vocab, matrix
+
+
+def _lexical_select(user_message: str, full_list: Sequence[dict]) -> list[str] | None:
+    """
+    Pick store(s) by TF-IDF overlap with the descriptions — one GEMV over
+    the pre-normalized description matrix, not a Python loop per store.
+    Returns None when the scores are too close to call (defer to Gemini).
+    """
+    ids, vocab, matrix = _fit_lexical_model(full_list)
+    q_tokens = _tokenize(user_message)
+    if not q_tokens or len(ids) < 2:
+        return None
+
+    q = np.zeros(len(vocab), dtype=np.float32)
+    matched = 0
+    for tok in set(q_tokens):
+        col = vocab.get(tok)
+        if col is not None:
+            matched += 1
+            q[col] += q_tokens.count(tok)
+    if matched < _MIN_MATCHED_TOKENS:
+        return None  # too little lexical evidence; let Gemini decide
+
+    q /= np.linalg.norm(q)
+    scores = matrix @ q  # cosine per store (rows are pre-normalized)
+    order = np.argsort(scores)
+    top_score = float(scores[order[-1]])
+    runner_score = float(scores[order[-2]])
+    if top_score < _MIN_SCORE:
+        return None  # overlap exists but is weak: let Gemini decide
+    if runner_score > 0.0 and (top_score - runner_score) / top_score < _TIE_EPSILON:
+        return None  # ambiguous: let Gemini decide
+
+    selected = [ids[order[-1]]]
+    if runner_score >= _SELECT_RATIO * top_score:
+        selected.append(ids[order[-2]])
+    return selected
 
 
 async def select_stores_for_query(
@@ -44,20 +219,37 @@ async def select_stores_for_query(
     extra_stores: list[dict] | None = None,
 ) -> list[str]:
     """
-    Given the user message, ask Gemini which store(s) are relevant.
+    Given the user message, decide which store(s) are relevant.
     Uses the four initial stores (Allegato A) plus extra_stores (from API).
     Returns a list of store ids.
 
+    Clear-cut messages are routed locally by TF-IDF overlap with the store
+    descriptions; Gemini is asked only when the lexical scores are ambiguous.
     Falls back to ["general_info"] if client is None or the call fails.
     """
     full_list, valid_ids = _build_store_list(extra_stores)
+
+    lexical = _lexical_select(user_message, full_list)
+    if lexical is not None:
+        logger.info(f"Store selection (lexical): {lexical}")
+        return lexical
+
     if not client or not GEMINI_API_KEY:
         logger.warning("Store selector: no client or API key, using default general_info")
         return ["general_info"]
 
-    store_list_text = "\n".join(
-        f"- {s['id']}: {s['description']}" for s in full_list
-    )
+    if gemini_breaker.is_open():
+        logger.warning("Store selector: Gemini circuit open, using default general_info")
+        return ["general_info"]
+
+    registry_key = tuple((s["id"], s["description"]) for s in full_list)
+    cache_key = (user_message.strip().lower(), registry_key)
+    cached = _selection_cache_get(cache_key)
+    if cached is not None:
+        logger.info(f"Store selection (cached): {cached}")
+        return cached
+
+    store_list_text = _render_store_list(registry_key)
     prompt = f"""Sei un assistente che classifica le domande degli utenti rispetto a categorie di informazioni del sito ULSS 9 Scaligera.
 
 Elenco delle categorie (stores) disponibili:
@@ -68,30 +260,42 @@ Domanda dell'utente: "{user_message}"
 Indica quali categorie sono rilevanti per rispondere alla domanda (puoi sceglierne una o più).
 Rispondi SOLO con un JSON valido con chiavi: "stores" (array di id, es. ["hours", "locations"]) e "reason" (breve motivazione in italiano)."""
 
-    try:
-        config = types.GenerateContentConfig(
-            response_mime_type="application/json",
-            response_schema=StoreSelectionOutput,
-            temperature=0.2,
-        )
-        response = await asyncio.to_thread(
-            lambda: client.models.generate_content(
-                model=MODEL,
-                contents=prompt,
-                config=config,
+    async def _classify() -> list[str]:
+        try:
+            response = await with_retry(
+                lambda: asyncio.to_thread(
+                    lambda: client.models.generate_content(
+                        model=MODEL,
+                        contents=prompt,
+                        config=_SELECTION_CONFIG,
+                    )
+                ),
+                retries=2,
             )
-        )
-        parsed = response.parsed
-        if not parsed or not isinstance(parsed, StoreSelectionOutput):
-            logger.warning("Store selector: invalid parsed response, using general_info")
+            gemini_breaker.record_success()
+            parsed = response.parsed
+            if not parsed or not isinstance(parsed, StoreSelectionOutput):
+                logger.warning("Store selector: invalid parsed response, using general_info")
+                return ["general_info"]
+
+            # Keep only ids that exist in registry, deduped and capped so an
+            # oversized model response cannot inflate the selection
+            selected = list(dict.fromkeys(s for s in parsed.stores if s in valid_ids))[: len(full_list)]
+            unknown = [s for s in parsed.stores if s not in valid_ids]
+            if unknown:
+                logger.warning(f"Store selector: Gemini returned unknown store ids {unknown}")
+            if not selected:
+                selected = ["general_info"]
+            logger.info(f"Store selection: {selected} (reason: {parsed.reason})")
+            # Only genuine classifications are cached; the error fallback
+            # below is transient and should be retried by the next request
+            _selection_cache_put(cache_key, selected)
+            return selected
+        except Exception as e:
+            if is_retryable(e):
+                gemini_breaker.record_failure()
+            logger.error(f"Store selection failed: {e}", exc_info=True)
             return ["general_info"]
 
-        # Keep only ids that exist in registry
-        selected = [s for s in parsed.stores if s in valid_ids]
-        if not selected:
-            selected = ["general_info"]
-        logger.info(f"Store selection: {selected} (reason: {parsed.reason})")
-        return selected
-    except Exception as e:
-        logger.error(f"Store selection failed: {e}", exc_info=True)
-        return ["general_info"]
+    # Concurrent identical questions share one in-flight classification
+    return list(await _selection_coalescer.run(cache_key, _classify))
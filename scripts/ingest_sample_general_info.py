@@ -14,6 +14,9 @@ general_info Gemini File Search Store so RAG can use them for answers.
 """
 
 import asyncio
+import hashlib
+import json
+import os
 import sys
 from pathlib import Path
 
@@ -32,6 +35,29 @@ from app.services.store_manager import StoreManager
 SAMPLE_DIR = BACKEND_ROOT / "data" / "ulss9_sample" / "general_info"
 ALLOWED_EXTENSIONS = (".md", ".txt")
 
+# Uploads are almost entirely remote-API wait, so run them concurrently
+# (bounded to stay inside Gemini rate limits)
+INGEST_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", "5"))
+
+# Sidecar manifest of already-uploaded content (name -> blake2b digest);
+# reruns skip unchanged files so incremental ingest is near-instant
+MANIFEST_PATH = SAMPLE_DIR / ".ingested_manifest.json"
+
+
+def _digest(path: Path) -> str:
+    return hashlib.blake2b(path.read_bytes(), digest_size=16).hexdigest()
+
+
+def _load_manifest() -> dict[str, str]:
+    try:
+        return json.loads(MANIFEST_PATH.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_manifest(manifest: dict[str, str]) -> None:
+    MANIFEST_PATH.write_text(json.dumps(manifest, indent=2, sort_keys=True), encoding="utf-8")
+
 
 async def main() -> None:
     if not GEMINI_API_KEY:
@@ -65,17 +91,36 @@ async def main() -> None:
     else:
         print("Store 'general_info' already exists.")
 
-    print(f"Uploading {len(files)} file(s) to store 'general_info'...")
-    for path in files:
-        try:
-            result = await store_manager.upload_document(
+    # Skip files whose content already matches the last successful ingest
+    manifest = _load_manifest()
+    digests = {f.name: _digest(f) for f in files}
+    to_upload = [f for f in files if manifest.get(f.name) != digests[f.name]]
+    skipped = len(files) - len(to_upload)
+    if skipped:
+        print(f"Skipping {skipped} unchanged file(s) (tracked in {MANIFEST_PATH.name}).")
+    if not to_upload:
+        print("Nothing to upload. You can now ask the chatbot questions about ULSS 9 (informazioni generali).")
+        return
+
+    print(f"Uploading {len(to_upload)} file(s) to store 'general_info' ({INGEST_CONCURRENCY} at a time)...")
+    sem = asyncio.Semaphore(INGEST_CONCURRENCY)
+
+    async def _upload_one(path: Path) -> dict:
+        async with sem:
+            return await store_manager.upload_document(
                 str(path),
                 "general_info",
                 source_type="attachment",
             )
+
+    results = await asyncio.gather(*(_upload_one(p) for p in to_upload), return_exceptions=True)
+    for path, result in zip(to_upload, results):
+        if isinstance(result, BaseException):
+            print(f"  FAIL: {path.name} - {result}")
+        else:
             print(f"  OK: {path.name} -> {result.get('title', path.name)}")
-        except Exception as e:
-            print(f"  FAIL: {path.name} - {e}")
+            manifest[path.name] = digests[path.name]
+    _save_manifest(manifest)
 
     print("Done. You can now ask the chatbot questions about ULSS 9 (informazioni generali).")
 
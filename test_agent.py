@@ -23,28 +23,28 @@ async def test():
         print("❌ Client not initialized!")
         return
     
-    print("Testing simple message without domain...")
-    try:
-        result = await agent.chat("Hello, this is a test", domain=None)
-        print(f"Response length: {len(result.get('response', ''))}")
-        print(f"Is demo: {'demo' in result.get('response', '').lower() or '⚠️' in result.get('response', '')}")
-        print(f"Response preview: {result.get('response', '')[:200]}")
-    except Exception as e:
-        print(f"❌ Error: {e}")
-        import traceback
-        traceback.print_exc()
-    
-    print()
-    print("Testing with domain 'schoolarship'...")
-    try:
-        result = await agent.chat("What scholarships are available?", domain="schoolarship")
+    # Both calls hit Gemini independently; run them concurrently
+    print("Testing simple message without domain and domain 'schoolarship' concurrently...")
+    no_domain, scholarship = await asyncio.gather(
+        agent.chat("Hello, this is a test", domain=None),
+        agent.chat("What scholarships are available?", domain="schoolarship"),
+        return_exceptions=True,
+    )
+
+    for label, result in [
+        ("simple message without domain", no_domain),
+        ("domain 'schoolarship'", scholarship),
+    ]:
+        print()
+        print(f"Result for {label}:")
+        if isinstance(result, BaseException):
+            print(f"❌ Error: {result}")
+            import traceback
+            traceback.print_exception(result)
+            continue
         print(f"Response length: {len(result.get('response', ''))}")
         print(f"Is demo: {'demo' in result.get('response', '').lower() or '⚠️' in result.get('response', '')}")
         print(f"Response preview: {result.get('response', '')[:200]}")
-    except Exception as e:
-        print(f"❌ Error: {e}")
-        import traceback
-        traceback.print_exc()
 
 if __name__ == "__main__":
     asyncio.run(test())
@@ -1,12 +1,37 @@
 """Pytest configuration and shared fixtures for API tests."""
 
+from unittest.mock import MagicMock
+
+import httpx
 import pytest
-from fastapi.testclient import TestClient
+import pytest_asyncio
 
+from app.api.admin import get_store_manager
+from app.api.auth import require_admin
 from app.main import app
 
 
+@pytest_asyncio.fixture(scope="session", loop_scope="session")
+async def client():
+    """
+    In-process ASGI client: requests run directly against the app without
+    a server thread per call, built once per session instead of per test.
+    Admin auth is overridden so admin endpoints are exercised without
+    minting a JWT.
+    """
+    app.dependency_overrides[require_admin] = lambda: "test-admin"
+    transport = httpx.ASGITransport(app=app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as c:
+            yield c
+    finally:
+        app.dependency_overrides.pop(require_admin, None)
+
+
 @pytest.fixture
-def client() -> TestClient:
-    """FastAPI test client (no live server)."""
-    return TestClient(app)
+def store_manager_mock():
+    """Replace the shared StoreManager dependency with a configurable mock."""
+    mock = MagicMock()
+    app.dependency_overrides[get_store_manager] = lambda: mock
+    yield mock
+    app.dependency_overrides.pop(get_store_manager, None)
@@ -4,27 +4,27 @@ API tests for ULSS 9 Chatbot backend.
 Chat and admin endpoints that call Gemini are mocked so tests run without an API key.
 """
 
+import json
 from unittest.mock import AsyncMock, patch
 
-import pytest
-from fastapi.testclient import TestClient
+import httpx
 
 
 # ----- Health & public -----
 
 
-def test_health(client: TestClient) -> None:
+async def test_health(client: httpx.AsyncClient) -> None:
     """GET /health returns 200 and app name."""
-    r = client.get("/health")
+    r = await client.get("/health")
     assert r.status_code == 200
     data = r.json()
     assert data["status"] == "healthy"
     assert "ulss9" in data.get("app", "").lower()
 
 
-def test_welcome(client: TestClient) -> None:
+async def test_welcome(client: httpx.AsyncClient) -> None:
     """GET /api/welcome returns message and suggestions."""
-    r = client.get("/api/welcome")
+    r = await client.get("/api/welcome")
     assert r.status_code == 200
     data = r.json()
     assert "message" in data
@@ -33,9 +33,9 @@ def test_welcome(client: TestClient) -> None:
     assert "available_domains" in data
 
 
-def test_domains(client: TestClient) -> None:
+async def test_domains(client: httpx.AsyncClient) -> None:
     """GET /api/domains returns list of stores (four initial + any extra)."""
-    r = client.get("/api/domains")
+    r = await client.get("/api/domains")
     assert r.status_code == 200
     data = r.json()
     assert isinstance(data, list)
@@ -54,7 +54,7 @@ def test_domains(client: TestClient) -> None:
 # ----- Chat (mocked) -----
 
 
-def test_chat_with_domain_mocked(client: TestClient) -> None:
+async def test_chat_with_domain_mocked(client: httpx.AsyncClient) -> None:
     """POST /api/chat with domain returns response from mocked agent."""
     mock_result = {
         "response": "Risposta di test per general_info.",
@@ -63,7 +63,7 @@ def test_chat_with_domain_mocked(client: TestClient) -> None:
         "stores_used": ["general_info"],
     }
     with patch("app.api.chat.agent.chat", new_callable=AsyncMock, return_value=mock_result):
-        r = client.post(
+        r = await client.post(
             "/api/chat",
             json={"message": "Qual è il numero dell'URP?", "domain": "general_info"},
         )
@@ -76,7 +76,7 @@ def test_chat_with_domain_mocked(client: TestClient) -> None:
     assert data["domain"] == "general_info"
 
 
-def test_chat_without_domain_mocked(client: TestClient) -> None:
+async def test_chat_without_domain_mocked(client: httpx.AsyncClient) -> None:
     """POST /api/chat without domain uses store selection then RAG (mocked)."""
     mock_result = {
         "response": "Risposta generata da RAG.",
@@ -88,7 +88,7 @@ def test_chat_without_domain_mocked(client: TestClient) -> None:
         patch("app.api.chat.select_stores_for_query", new_callable=AsyncMock, return_value=["general_info"]),
         patch("app.api.chat.agent.chat", new_callable=AsyncMock, return_value=mock_result),
     ):
-        r = client.post("/api/chat", json={"message": "Chi è l'ULSS 9?"})
+        r = await client.post("/api/chat", json={"message": "Chi è l'ULSS 9?"})
     assert r.status_code == 200
     data = r.json()
     assert data["response"] == mock_result["response"]
@@ -96,13 +96,13 @@ def test_chat_without_domain_mocked(client: TestClient) -> None:
     assert data["domain"] is None
 
 
-def test_chat_requires_message(client: TestClient) -> None:
+async def test_chat_requires_message(client: httpx.AsyncClient) -> None:
     """POST /api/chat without message returns 422."""
-    r = client.post("/api/chat", json={})
+    r = await client.post("/api/chat", json={})
     assert r.status_code == 422
 
 
-def test_chat_accepts_conversation_id(client: TestClient) -> None:
+async def test_chat_accepts_conversation_id(client: httpx.AsyncClient) -> None:
     """POST /api/chat accepts optional conversation_id."""
     mock_result = {
         "response": "OK",
@@ -111,7 +111,7 @@ def test_chat_accepts_conversation_id(client: TestClient) -> None:
         "stores_used": [],
     }
     with patch("app.api.chat.agent.chat", new_callable=AsyncMock, return_value=mock_result):
-        r = client.post(
+        r = await client.post(
             "/api/chat",
             json={
                 "message": "Test",
@@ -122,41 +122,72 @@ def test_chat_accepts_conversation_id(client: TestClient) -> None:
     assert r.status_code == 200
 
 
+async def test_chat_stream_mocked(client: httpx.AsyncClient) -> None:
+    """POST /api/chat/stream emits delta events then a final ChatResponse-shaped event."""
+
+    def fake_stream(**kwargs):
+        async def gen():
+            yield {"delta": "Ciao"}
+            yield {"delta": " mondo"}
+            yield {
+                "response": "Ciao mondo",
+                "sources": [{"title": "Fonte", "snippet": "..."}],
+                "links": [],
+                "stores_used": ["general_info"],
+            }
+        return gen()
+
+    with patch("app.api.chat.agent.chat_stream", new=fake_stream):
+        r = await client.post(
+            "/api/chat/stream",
+            json={"message": "Saluta", "domain": "general_info"},
+        )
+    assert r.status_code == 200
+    events = [
+        json.loads(block[len("data: "):])
+        for block in r.text.split("\n\n")
+        if block.startswith("data: ")
+    ]
+    assert events[0] == {"delta": "Ciao"}
+    assert events[1] == {"delta": " mondo"}
+    final = events[-1]
+    assert final["response"] == "Ciao mondo"
+    assert final["sources"] == [{"title": "Fonte", "snippet": "..."}]
+    assert final["stores_used"] == ["general_info"]
+    assert final["domain"] == "general_info"
+    assert isinstance(final["suggested_questions"], list)
+
+
 # ----- Admin: stores -----
 
 
-def test_admin_list_stores(client: TestClient) -> None:
+async def test_admin_list_stores(client: httpx.AsyncClient, store_manager_mock) -> None:
     """GET /api/admin/stores returns list (may be empty without API key)."""
-    r = client.get("/api/admin/stores")
+    store_manager_mock.list_stores = AsyncMock(return_value=[])
+    r = await client.get("/api/admin/stores")
     assert r.status_code == 200
     assert isinstance(r.json(), list)
 
 
-def test_admin_create_store_mocked(client: TestClient) -> None:
+async def test_admin_create_store_mocked(client: httpx.AsyncClient, store_manager_mock) -> None:
     """POST /api/admin/stores creates a store (mocked)."""
     fake_store = type("Store", (), {"name": "stores/fake-123", "display_name": "ulss9-docs"})()
-    with patch(
-        "app.api.admin.StoreManager",
-    ) as MockSM:
-        mock_instance = MockSM.return_value
-        mock_instance.create_store = AsyncMock(return_value=fake_store)
-        r = client.post(
-            "/api/admin/stores",
-            json={"domain": "docs", "description": "Documenti ufficiali"},
-        )
+    store_manager_mock.create_store = AsyncMock(return_value=fake_store)
+    r = await client.post(
+        "/api/admin/stores",
+        json={"domain": "docs", "description": "Documenti ufficiali"},
+    )
     assert r.status_code == 200
     data = r.json()
     assert data["success"] is True
     assert data["domain"] == "docs"
 
 
-def test_admin_create_all_ulss9_mocked(client: TestClient) -> None:
+async def test_admin_create_all_ulss9_mocked(client: httpx.AsyncClient, store_manager_mock) -> None:
     """POST /api/admin/stores/ulss9/create-all creates four stores (mocked)."""
     fake_store = type("Store", (), {"name": "stores/fake", "display_name": "ulss9-x"})()
-    with patch("app.api.admin.StoreManager") as MockSM:
-        mock_instance = MockSM.return_value
-        mock_instance.create_store = AsyncMock(return_value=fake_store)
-        r = client.post("/api/admin/stores/ulss9/create-all")
+    store_manager_mock.create_store = AsyncMock(return_value=fake_store)
+    r = await client.post("/api/admin/stores/ulss9/create-all")
     assert r.status_code == 200
     data = r.json()
     assert data["success"] is True
@@ -164,26 +195,22 @@ def test_admin_create_all_ulss9_mocked(client: TestClient) -> None:
     assert len(data["stores"]) == 4
 
 
-def test_admin_delete_store_not_found_mocked(client: TestClient) -> None:
+async def test_admin_delete_store_not_found_mocked(client: httpx.AsyncClient, store_manager_mock) -> None:
     """DELETE /api/admin/stores/{domain} returns 404 when store does not exist."""
-    with patch("app.api.admin.StoreManager") as MockSM:
-        mock_instance = MockSM.return_value
-        mock_instance.delete_store = AsyncMock(return_value=False)
-        r = client.delete("/api/admin/stores/nonexistent")
+    store_manager_mock.delete_store = AsyncMock(return_value=False)
+    r = await client.delete("/api/admin/stores/nonexistent")
     assert r.status_code == 404
 
 
-def test_admin_delete_all_stores_mocked(client: TestClient) -> None:
+async def test_admin_delete_all_stores_mocked(client: httpx.AsyncClient, store_manager_mock) -> None:
     """POST /api/admin/stores/delete-all deletes all stores (mocked)."""
-    with patch("app.api.admin.StoreManager") as MockSM:
-        mock_instance = MockSM.return_value
-        mock_instance.list_stores = AsyncMock(
-            return_value=[
-                type("StoreInfo", (), {"domain": "general_info", "display_name": "ulss9-general_info", "document_count": 0})(),
-            ]
-        )
-        mock_instance.delete_store = AsyncMock(return_value=True)
-        r = client.post("/api/admin/stores/delete-all")
+    store_manager_mock.list_stores = AsyncMock(
+        return_value=[
+            type("StoreInfo", (), {"domain": "general_info", "display_name": "ulss9-general_info", "document_count": 0})(),
+        ]
+    )
+    store_manager_mock.delete_store = AsyncMock(return_value=True)
+    r = await client.post("/api/admin/stores/delete-all")
     assert r.status_code == 200
     data = r.json()
     assert data["success"] is True
@@ -193,9 +220,9 @@ def test_admin_delete_all_stores_mocked(client: TestClient) -> None:
 # ----- Admin: documents -----
 
 
-def test_admin_upload_rejects_bad_file_type(client: TestClient) -> None:
+async def test_admin_upload_rejects_bad_file_type(client: httpx.AsyncClient) -> None:
     """POST /api/admin/stores/{domain}/upload returns 400 for unsupported file type."""
-    r = client.post(
+    r = await client.post(
         "/api/admin/stores/general_info/upload",
         files={"file": ("bad.csv", b"col1,col2\n1,2", "text/csv")},
     )
@@ -203,31 +230,52 @@ def test_admin_upload_rejects_bad_file_type(client: TestClient) -> None:
     assert "supported" in r.json().get("detail", "").lower()
 
 
-def test_admin_list_documents_mocked(client: TestClient) -> None:
+async def test_admin_upload_batch_partial_failure_mocked(
+    client: httpx.AsyncClient, store_manager_mock, monkeypatch, tmp_path
+) -> None:
+    """POST /api/admin/stores/{domain}/upload-batch returns per-file results; one bad file does not abort the rest."""
+    monkeypatch.setattr("app.api.admin.DATA_DIR", tmp_path)
+    store_manager_mock.upload_document = AsyncMock(
+        return_value={"document_id": "doc-1", "title": "Ciao"}
+    )
+    r = await client.post(
+        "/api/admin/stores/general_info/upload-batch",
+        files=[
+            ("files", ("ok.md", b"# ciao", "text/markdown")),
+            ("files", ("bad.csv", b"col1,col2\n1,2", "text/csv")),
+        ],
+    )
+    assert r.status_code == 200
+    data = r.json()
+    assert data["success"] is False  # one file failed
+    results = {res["filename"]: res for res in data["results"]}
+    assert results["ok.md"]["success"] is True
+    assert results["ok.md"]["title"] == "Ciao"
+    assert results["bad.csv"]["success"] is False
+    assert "supported" in results["bad.csv"]["message"].lower()
+
+
+async def test_admin_list_documents_mocked(client: httpx.AsyncClient, store_manager_mock) -> None:
     """GET /api/admin/stores/{domain}/documents returns list (mocked)."""
-    with patch("app.api.admin.StoreManager") as MockSM:
-        mock_instance = MockSM.return_value
-        mock_instance.list_documents = AsyncMock(return_value=[])
-        r = client.get("/api/admin/stores/general_info/documents")
+    store_manager_mock.list_documents = AsyncMock(return_value=[])
+    r = await client.get("/api/admin/stores/general_info/documents")
     assert r.status_code == 200
     assert r.json() == []
 
 
-def test_admin_delete_document_not_found_mocked(client: TestClient) -> None:
+async def test_admin_delete_document_not_found_mocked(client: httpx.AsyncClient, store_manager_mock) -> None:
     """DELETE /api/admin/stores/{domain}/documents/{doc} returns 404 when doc not found."""
-    with patch("app.api.admin.StoreManager") as MockSM:
-        mock_instance = MockSM.return_value
-        mock_instance.delete_document = AsyncMock(return_value=False)
-        r = client.delete("/api/admin/stores/general_info/documents/some-doc-name")
+    store_manager_mock.delete_document = AsyncMock(return_value=False)
+    r = await client.delete("/api/admin/stores/general_info/documents/some-doc-name")
     assert r.status_code == 404
 
 
 # ----- Agent status (no mock) -----
 
 
-def test_agent_status(client: TestClient) -> None:
+async def test_agent_status(client: httpx.AsyncClient) -> None:
     """GET /api/agent/status returns api_key_set and client info."""
-    r = client.get("/api/agent/status")
+    r = await client.get("/api/agent/status")
     assert r.status_code == 200
     data = r.json()
     assert "api_key_set" in data